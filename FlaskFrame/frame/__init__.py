@@ -1,21 +1,21 @@
 # -*- coding:utf-8 -*-
 import logging
-import redis
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 from flask_session import Session
 from config import config, Config
 from utils.commons import RegexConverter
+from .db_routing import RoutingSQLAlchemy
+from .redis_client import get_client
 from logging.handlers import RotatingFileHandler
 
 
-# 创建数据库对象
-db = SQLAlchemy()
+# 创建数据库对象， 只读查询可以发往从库
+db = RoutingSQLAlchemy()
 
-# 创建redis对象
-redis_store = redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT)
+# 创建redis对象， 与flask-session共用进程内的连接池
+redis_store = get_client()
 
 # 使用wtf提供的csrf保护机制
 csrf = CSRFProtect()
@@ -36,8 +36,11 @@ file_log_handler.setFormatter(formatter)
 logging.getLogger().addHandler(file_log_handler)
 
 
-def create_app(config_name):
-    """创建flask应用app对象"""
+def create_app(config_name, background=True):
+    """
+    创建flask应用app对象
+    :param background: 是否启动后台线程， manage.py的命令不需要
+    """
 
     app = Flask(__name__)
 
@@ -53,9 +56,21 @@ def create_app(config_name):
     # 为app添加CSRF保护
     csrf.init_app(app)
 
+    # redis连接参数从app的配置读取
+    from . import redis_client
+    redis_client.init_app(app)
+
     # 使用flask-session扩展，用redis保存app的session数据
+    app.config["SESSION_REDIS"] = redis_store
     Session(app)
 
+    # 只读请求使用从库
+    from . import db_routing
+    db_routing.init_app(app, db)
+
+    # 注册订单写入回调
+    from . import events
+
     # 为app添加api蓝图应用
     from .api_1_0 import api as api_1_0_blueprint
     app.register_blueprint(api_1_0_blueprint, url_prefix="/api/v1.0")
@@ -64,4 +79,23 @@ def create_app(config_name):
     from .web_page import html as html_blueprint
     app.register_blueprint(html_blueprint)
 
+    # 配置为应用内补充验证码池时， 启动补充线程(生产环境使用manage.py run_captcha_pool)
+    from . import captcha_pool
+    if background and captcha_pool.in_app():
+        captcha_pool.start_refiller()
+
+    # 预加载redis脚本
+    from . import redis_scripts
+    redis_scripts.preload()
+
+    # 启动房屋订单数增量的定时写回
+    from . import counters
+    if background and counters.in_app():
+        counters.start_flusher(app)
+
+    # 使用房屋列快照时， 启动快照的定时生成
+    from . import house_snapshot
+    if background and house_snapshot.enabled():
+        house_snapshot.start_rebuilder(app)
+
     return app
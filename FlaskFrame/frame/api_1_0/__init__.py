@@ -1,17 +1,28 @@
 # -*- coding:utf-8 -*-
 
-from flask import Blueprint
+from flask import Blueprint, jsonify
+
+from FlaskFrame.frame import rate_limit
+from FlaskFrame.utils.response_code import RET
 
 api = Blueprint('api', __name__)
 
 
-from . import user, house
+from . import user, house, export, metrics
+
+
+@api.before_request
+def limit_request_rate():
+    """按接口限流， 在视图函数之前执行"""
+    if not rate_limit.check():
+        return jsonify(errno=RET.REQERR, errmsg="请求过于频繁， 请稍后再试")
 
 
 @api.after_request
 def after_request(response):
     """设置默认的响应报文格式为application/json"""
-    # 如果响应报文response的Content-Type是以text开头，则将其改为默认的json类型
-    if response.headers.get("Content-Type").startswith("text"):
+    # 如果响应报文response的Content-Type是以text开头，则将其改为默认的json类型， 导出的csv文件除外
+    content_type = response.headers.get("Content-Type")
+    if content_type.startswith("text") and not content_type.startswith("text/csv"):
         response.headers["Content-Type"] = "application/json"
     return response
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# 导入蓝图对象
+from . import api
+
+# 导入flask内置函数对象
+from flask import current_app, jsonify, g, request, Response, stream_with_context
+
+# 导入自定义状态码
+from FlaskFrame.utils.response_code import RET
+
+# 导入登陆装饰器
+from FlaskFrame.utils.commons import login_required
+
+# 导入配置常量
+from FlaskFrame.config import conf
+
+# 导入导出工具
+from FlaskFrame.frame import export
+
+from FlaskFrame.utils.logger import Log
+
+# 初始化log日志参数路径
+logger = Log('export').logger
+
+
+EXPORT_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+@api.route('/export/<table>', methods=['GET'])
+@login_required
+def export_table(table):
+    '''
+    流式导出房屋或订单表
+    1. 校验用户是否为运营人员
+    2. 获取参数， 导出格式format(ndjson/csv)， 编号范围start_id/end_id(都包含)
+    3. 校验参数
+    4. 用生成器分批读取并逐行返回， 中断后用最后一行的id+1作为start_id续传
+    :return:
+    '''
+
+    # 只有运营人员可以导出
+    if g.user_id not in conf.EXPORT_USER_IDS:
+        return jsonify(errno=RET.ROLEERR, errmsg="没有导出权限")
+
+    # 获取参数
+    fmt = request.args.get("format", "ndjson")
+    start_id = request.args.get("start_id", "")
+    end_id = request.args.get("end_id", "")
+
+    # 校验参数
+    try:
+        assert table in export.EXPORT_TABLES
+        assert fmt in export.EXPORT_FORMATS
+        start_id = int(start_id) if start_id else None
+        end_id = int(end_id) if end_id else None
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+
+    logger.info("user %s export %s format=%s start_id=%s end_id=%s" % (g.user_id, table, fmt, start_id, end_id))
+
+    filename = "%s_%s_%s.%s" % (table, start_id or "", end_id or "", fmt)
+    response = Response(stream_with_context(export.iter_export(table, fmt, start_id, end_id)),
+                        mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers["Content-Disposition"] = "attachment; filename=%s" % filename
+    return response
@@ -10,7 +10,7 @@ from flask import current_app, jsonify, g, request, session
 from FlaskFrame.frame import redis_store,  db
 
 # 导入模型类对象
-from FlaskFrame.frame.models import Area, House, Facility, HouseImage, User, Order
+from FlaskFrame.frame.models import Area, House, Facility, HouseImage, Order, HouseDailyStat
 
 # 导入自定义状态码
 from FlaskFrame.utils.response_code import RET
@@ -21,6 +21,13 @@ from FlaskFrame.utils.commons import login_required
 # 导入七牛云接口
 from FlaskFrame.utils.image_storage import storage
 
+# 导入配置常量
+from FlaskFrame.config import conf
+
+# 导入房屋预订日历， 报价， 订单数计数器， 首页排行， 房屋基本信息缓存， 房屋列表索引， 房屋列快照， 搜索聚合数据， 关键字索引， 搜索联想， 相似房屋， 房东统计， 批量导入， 数据库操作范围， redis脚本
+from FlaskFrame.frame import booking_calendar, pricing, counters, ranking, house_cache, search_index, house_snapshot, \
+    facets, keyword_index, suggest, similar, house_stats, house_import, db_scope, redis_scripts
+
 from FlaskFrame.utils.logger import Log
 
 # 导入json
@@ -28,6 +35,8 @@ import json
 
 import datetime
 
+from sqlalchemy import and_, case, func
+
 # 初始化log日志参数路径
 logger = Log('house').logger
 
@@ -169,12 +178,20 @@ def save_house_info():
     # 尝试获取配套设施
     facility = house_data.get("facility")
 
-    # 如果存在， 过滤编号
+    # 如果存在， 过滤编号， 超出位掩码范围的设施编号无法保存
     if facility:
+        try:
+            facility = [int(item) for item in facility]
+            assert all(0 < item <= conf.HOUSE_FACILITY_MAX_ID for item in facility)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR, errmsg="设施参数错误")
+
         try:
             facilities = Facility.query.filter(Facility.id.in_(facility)).all()
-            # 保存设施
+            # 保存设施， 同时保存设施位掩码用于列表过滤
             house.facilities = facilities
+            house.facility_mask = House.make_facility_mask([item.id for item in facilities])
         except Exception as e:
             current_app.logger.error(e)
             return jsonify(errno=RET.DBERR, errmsg="数据库异常")
@@ -192,6 +209,40 @@ def save_house_info():
     return jsonify(errno=RET.OK, errmsg="OK", data={"house_id": house.id})
 
 
+@api.route('/houses/import', methods=["POST"])
+@login_required
+def import_houses():
+    '''
+    *批量导入房屋*
+    1. 获取用户信息
+    2. 获取参数， 导入格式format(csv/ndjson)， 默认根据Content-Type判断
+    3. 逐行读取请求体， 按批校验并写入
+    4. 返回导入数量和失败行的原因
+    :return:
+    '''
+
+    # 获取用户身份
+    user_id = g.user_id
+
+    # 获取导入格式
+    fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if fmt not in house_import.IMPORT_FORMATS:
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+
+    # 请求体按行流式读取， 不一次读入内存
+    lines = (line.decode("utf-8") for line in request.stream)
+    try:
+        result = house_import.import_houses(user_id, house_import.parse_rows(lines, fmt))
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="导入失败")
+
+    logger.info("user %s imported %s houses, %s failed" % (user_id, result["imported"], result["failed"]))
+
+    # 返回结果
+    return jsonify(errno=RET.OK, errmsg="OK", data=result)
+
+
 @api.route('/houses/<house_id>/images', methods=["POST"])
 @login_required
 def save_house_image(house_id):
@@ -199,11 +250,11 @@ def save_house_image(house_id):
     *保存房屋图片*
     1. 获取参数
     2. 校验图片参数存在
-    3. 根据house_id查询数据库， 确认房屋存在
+    3. 根据house_id查询数据库， 确认房屋存在， 查询后立即归还连接
     4. 校验查询结果
     5. 读取图片数据
-    6. 调用器牛云接口
-    7. 构造模型类
+    6. 调用器牛云接口， 调用期间不占用数据库连接
+    7. 重新查询房屋， 构造模型类
     8. 判断房屋图片是否设置， 否则设置为主页图片
     9. 提交数据到数据库
     10. 拼接图片路径
@@ -219,48 +270,57 @@ def save_house_image(house_id):
     if not image:
         return jsonify(errno=RET.PARAMERR, errmsg="参数不存在")
 
-    # 根据house_id 查询数据库， 确认房屋存在
+    # 根据house_id 查询数据库， 确认房屋存在， 查询之后立即归还连接
     try:
-        house = House.query.get(house_id)
+        with db_scope.db_unit():
+            house_exists = House.query.with_entities(House.id).filter_by(id=house_id).first() is not None
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="数据库异常")
 
     # 校验查询结果
-    if not house:
+    if not house_exists:
         return jsonify(errno=RET.NODATA, errmsg="无效操作")
 
     # 读取图片数据
     image_data = image.read()
 
-    # 调用七牛云接口
+    # 调用七牛云接口， 上传期间不占用数据库连接
     try:
-        image_name = storage(image_data)
+        with db_scope.outbound("qiniu"):
+            image_name = storage(image_data)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.THIRDERR, errmsg="第三方错误")
 
-    # 构造HouseImage模型类对象， 保存图片
-    house_image = HouseImage()
-    house_image.house_id = house_id
-    house_image.url = image_name
-
-    # 存入数据库会话中
-    db.session.add(house_image)
-
-    # 判断房屋主图片
-    if not house.index_image_url:
-        house.index_image_url = image_name
-        db.session.add(house)
-
-    # 提交数据
+    # 重新查询房屋， 保存图片， 判断房屋主图片， 提交数据
     try:
-        db.session.commit()
+        with db_scope.db_unit(commit=True):
+            house = House.query.get(house_id)
+
+            # 构造HouseImage模型类对象， 保存图片
+            house_image = HouseImage()
+            house_image.house_id = house_id
+            house_image.url = image_name
+            db.session.add(house_image)
+
+            is_index_image = not house.index_image_url
+            if is_index_image:
+                house.index_image_url = image_name
+                db.session.add(house)
+            house_order_count = house.order_count
     except Exception as e:
         current_app.logger.error(e)
-        db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="数据库异常")
 
+    # 设置了主图片的房屋加入首页排行， 删除基本信息缓存
+    if is_index_image:
+        try:
+            ranking.add_house(int(house_id), counters.merged_order_count(int(house_id), house_order_count))
+            house_cache.invalidate_basic(house_id)
+        except Exception as e:
+            current_app.logger.error(e)
+
     # 拼接图片绝对路径
     image_url = constants.QINIU_DOMIN_PREFIX + image_name
 
@@ -272,100 +332,75 @@ def save_house_image(house_id):
 @login_required
 def get_user_houses():
     '''
-    获取用户发布的房源
+    获取用户发布的房源： 缓存-磁盘-缓存
     1. 获取用户的身份信息user_id
-    2. 根据user_id 查询数据库， 确认用户的存在
-    3. 通过反向应用， 获取该用户的房屋信息
-    4. 定义容器， 存储查询结果
-    5. 判断如果有房源数据， 进行遍历
-    6. 返回结果
+    2. 获取页码参数， 进行格式化
+    3. 从缓存中获取该页数据， 没有缓存时只查询需要的列， 连接区域名称， 分页
+    4. 合并尚未写回的订单数
+    5. 返回结果
     :return:
     '''
 
     # 获取用户身份信息
     user_id = g.user_id
 
-    # 根据user_id 查询mysql数据库
+    # 对页码进行格式化
     try:
-        user = User.query.get(user_id)
-        # 反向引用， 获取该用户发布的房源
-        houses = user.houses
+        page = int(request.args.get("p", 1))
+        assert page > 0
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="查询失败")
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
 
-    # 定义容器
-    houses_list = []
+    # 分页获取房源
+    try:
+        data = house_cache.get_user_houses_page(user_id, page)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询失败")
 
-    # 判断数据
-    if houses:
-        for house in houses:
-            houses_list.append(house.to_basic_dict())
+    # 合并尚未写回的订单数
+    counters.merge_order_counts(data["houses"])
 
     # 返回结果
-    return jsonify(errno=RET.OK, errmsg="OK", data={"houses": houses_list})
+    return jsonify(errno=RET.OK, errmsg="OK", data=data)
 
 
 @api.route('/houses/index', methods=['GET'])
 def get_houses_index():
     '''
-    获取房屋首页幻灯片信息： 缓存-磁盘-缓存
-    1. 尝试从redis中获取幻灯片数据
-    2. 校验结果， 如果有数据， 记录访问时间， 返回结果
-    3. 查询/mysql数据库
-    4. 校验结果
-    5. 定义容器， 遍历存储结果， 判断是否设置房屋主图片， 如果为设置默认不添加
-    6. 对房屋数据进行序列化 转换为json
-    7. 对房屋数据存入缓存
-    8. 返回结果
+    获取房屋首页幻灯片信息： 排行-缓存
+    1. 从redis有序集合中获取成交量最高的房屋编号， 排行中只有设置了主图片的房屋
+    2. 校验结果
+    3. 根据房屋编号批量获取房屋基本信息缓存
+    4. 合并尚未写回的订单数
+    5. 返回结果
     :return:
     '''
 
-    #  尝试从redis中获取缓存
+    # 获取排行前几的房屋编号
     try:
-        ret = redis_store.get('home_page_data')
-    except Exception as e:
-        current_app.logger.error(e)
-        ret = None
-
-    # 判断获取结果， 如果有数据， 记录访问时间，返回结果
-    if ret:
-        current_app.logger.info('hit house index info redis')
-        return '{"errno": 0, "errmsg": "OK", "data": %s}' % ret
-
-    # 查询mysql数据库
-    try:
-        # 查询房屋表， 默认按照成交量从高到底排序， 返回五条数据
-        houses = House.query.order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES)
+        house_ids = ranking.top_house_ids(conf.HOME_PAGE_MAX_HOUSES)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="查询失败")
 
-    # 校验查询结果
-    if not houses:
+    # 校验结果
+    if not house_ids:
         return jsonify(errno=RET.NODATA, errmsg="无房屋数据")
 
-    # 定义容器， 遍历查询结果， 添加数据
-    houses_list = []
-
-    # 对房屋主图片是否设置进判断
-    for house in houses:
-        if not house.index_image_url:
-            continue
-        houses_list.append(house.to_basic_dict())
-
-    # 序列化数据
-    houses_json = json.dumps(houses_list)
-
-    # 把房屋数据存入缓存
+    # 批量获取房屋基本信息
     try:
-        redis_store.setex("home_page_data", constants.HOME_PAGE_DATA_REDIS_EXPIRES, houses_json)
+        houses_list = house_cache.get_basic_dicts(house_ids)
     except Exception as e:
         current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询失败")
 
-    # 构造响应报文， 返回结果
-    resp = '{"errno":0, "errmsg":"OK", "data":%s}' % houses_json
-    return resp
+    # 合并尚未写回的订单数
+    counters.merge_order_counts(houses_list)
+
+    # 返回结果
+    return jsonify(errno=RET.OK, errmsg="OK", data=houses_list)
 
 
 @api.route('/houses/<int:house_id>', methods=['GET'])
@@ -448,7 +483,8 @@ def get_houses_list():
     3. 确认用户选择的开始日期和结束日期至少1天
     4. 对页数进行格式化
     5. 尝试从redis中获取房屋列表信息
-    6. 构造键 redis_key = 'houses_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key)
+    6. 构造键 redis_key = 'houses_%s_%s_%s_%s_%s_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key,
+                                                               facility_str, price_min, price_max, guests, keyword)
     7. 判断获取结果
     8. 查询mysql
     9. 定义容器， 存储查询的过滤条件
@@ -468,6 +504,11 @@ def get_houses_list():
     start_date_str = request.args.get("sd", "")
     end_date_str = request.args.get("ed", "")
     sort_key = request.args.get("sk", "")
+    facility_str = request.args.get("fac", "")  # 必须具备的设施编号， 逗号分隔
+    price_min = request.args.get("pmin", "")  # 最低单价， 单位：元
+    price_max = request.args.get("pmax", "")  # 最高单价， 单位：元
+    guests = request.args.get("guests", "")  # 入住人数
+    keyword = request.args.get("q", "").strip()  # 标题、地址关键字， 可以配合sk=relevance按相关度排序
     page = request.args.get("p", 1)
 
     # 对日期格式化
@@ -488,16 +529,87 @@ def get_houses_list():
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR, errmsg="日期参数错误")
 
+    # 对设施参数格式化， 排序之后作为缓存键的一部分
+    try:
+        facility_ids = sorted(set(int(item) for item in facility_str.split(",") if item))
+        assert all(0 < item <= conf.HOUSE_FACILITY_MAX_ID for item in facility_ids)
+        facility_str = ",".join(str(item) for item in facility_ids)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="设施参数错误")
+
+    # 对价格、人数格式化， 价格由元转换为分
+    try:
+        price_min = int(float(price_min) * 100) if price_min else None
+        price_max = int(float(price_max) * 100) if price_max else None
+        guests = int(guests) if guests else None
+        if price_min is not None and price_max is not None:
+            assert price_min <= price_max
+        assert guests is None or guests > 0
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="价格或人数参数错误")
+
     # 对页码进行格式化
     try:
         page = int(page)
+        assert page >= 1
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
 
+    # 没有日期、设施、价格、人数、关键字过滤时， 可以直接使用redis有序集合索引分页
+    search_result = None
+    if search_index.enabled() and not (start_date or end_date or facility_ids or keyword
+                                       or price_min is not None or price_max is not None or guests):
+        try:
+            search_result = search_index.search(area_id, sort_key, page)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    # 索引首次构建期间返回None， 继续使用下面的方式查询
+    if search_result is not None:
+        houses_dict_list, total_page = search_result
+
+        # 合并尚未写回的订单数
+        counters.merge_order_counts(houses_dict_list)
+
+        resp = {"errno": 0, "errmsg": "OK",
+                "data": {"houses": houses_dict_list, "total_page": total_page, "current_page": page}}
+        return json.dumps(resp)
+
+    # 没有日期、关键字过滤时， 也可以使用进程内的房屋列快照分页
+    if house_snapshot.enabled() and not (start_date or end_date or keyword):
+        try:
+            search_result = house_snapshot.snapshot.search(area_id, sort_key, page,
+                                                           facility_ids=facility_ids,
+                                                           price_min=price_min, price_max=price_max,
+                                                           guests=guests)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    # 本机还没有生成快照时返回None， 继续查询mysql
+    if search_result is not None:
+        house_ids, total_page = search_result
+        try:
+            houses_dict_list = house_cache.get_basic_dicts(house_ids)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+        # 合并尚未写回的订单数
+        counters.merge_order_counts(houses_dict_list)
+
+        resp = {"errno": 0, "errmsg": "OK",
+                "data": {"houses": houses_dict_list, "total_page": total_page, "current_page": page}}
+        return json.dumps(resp)
+
     # 尝试从redis中获取缓存
+    redis_key = 'houses_%s_%s_%s_%s_%s_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key,
+                                                       facility_str, price_min, price_max, guests, keyword)
     try:
-        redis_key = 'houses_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key)
         ret = redis_store.hget(redis_key, page)
     except Exception as e:
         current_app.logger.error(e)
@@ -517,6 +629,19 @@ def get_houses_list():
         if area_id:
             params_filter.append(House.area_id == area_id)  # 返回的是一个对象
 
+        # 价格、人数范围过滤
+        if price_min is not None:
+            params_filter.append(House.price >= price_min)
+        if price_max is not None:
+            params_filter.append(House.price <= price_max)
+        if guests:
+            params_filter.append(House.capacity >= guests)
+
+        # 设施过滤， 按位与代替多表连接
+        if facility_ids:
+            required_mask = House.make_facility_mask(facility_ids)
+            params_filter.append(House.facility_mask.op("&")(required_mask) == required_mask)
+
         # 日期判断
         if start_date and end_date:
             conflict_orders = Order.query.filter(Order.begin_date <= end_date, Order.end_date >= start_date).all()
@@ -553,25 +678,54 @@ def get_houses_list():
                 # 取反
                 params_filter.append(House.id.notin_(conflict_houses_id))
 
-        # 判断排序
-        if "booking" == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.order_count.desc())
+        # 关键字查询时， 倒排索引的结果分批用mysql过滤， 在进程内排序分页， 总页数按过滤后的房屋数计算
+        if keyword:
+            def filter_chunk(chunk_ids):
+                rows = db.session.query(House.id, House.popularity, House.order_count, House.price,
+                                        House.create_time).filter(House.id.in_(chunk_ids), *params_filter).all()
+                return dict((row[0], row) for row in rows)
+
+            rows = keyword_index.filter_matches(keyword, filter_chunk)
+
+            # 稳定排序， 排序字段相同时保持相关度的顺序
+            if "booking" == sort_key:
+                rows.sort(key=lambda row: (row[1] or 0, row[2] or 0), reverse=True)
+            elif "price-inc" == sort_key:
+                rows.sort(key=lambda row: row[3])
+            elif "price-des" == sort_key:
+                rows.sort(key=lambda row: row[3], reverse=True)
+            elif "relevance" != sort_key:
+                rows.sort(key=lambda row: row[4] or datetime.datetime.min, reverse=True)
+
+            total_page = (len(rows) + conf.HOUSE_LIST_PAGE_CAPACITY - 1) // conf.HOUSE_LIST_PAGE_CAPACITY
+            start = (page - 1) * conf.HOUSE_LIST_PAGE_CAPACITY
+            page_ids = [row[0] for row in rows[start:start + conf.HOUSE_LIST_PAGE_CAPACITY]]
+            houses_by_id = dict((house.id, house) for house in
+                                House.query.filter(House.id.in_(page_ids)).all()) if page_ids else {}
+            houses_list = [houses_by_id[house_id] for house_id in page_ids if house_id in houses_by_id]
+
+        else:
+            # 判断排序
+            if "booking" == sort_key:
+                # 按衰减后的热度排序， 热度相同时按成交订单数
+                houses = House.query.filter(*params_filter).order_by(House.popularity.desc(),
+                                                                     House.order_count.desc())
 
-        elif "price-inc" == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.asc())
+            elif "price-inc" == sort_key:
+                houses = House.query.filter(*params_filter).order_by(House.price.asc())
 
-        elif "price-des" == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.desc())
+            elif "price-des" == sort_key:
+                houses = House.query.filter(*params_filter).order_by(House.price.desc())
 
-        else:
-            houses = House.query.filter(*params_filter).order_by(House.create_time.desc())
+            else:
+                houses = House.query.filter(*params_filter).order_by(House.create_time.desc())
 
-        # 对排序后的数据分页
-        houses_page = houses.paginate(page, constants.HOUSE_LIST_PAGE_CAPACITY, False)
+            # 对排序后的数据分页
+            houses_page = houses.paginate(page, conf.HOUSE_LIST_PAGE_CAPACITY, False)
 
-        # 获取分页后的房屋数据， 总页数
-        houses_list = houses_page.items
-        total_page = houses_page.pages
+            # 获取分页后的房屋数据， 总页数
+            houses_list = houses_page.items
+            total_page = houses_page.pages
 
         # 定义容器， 遍历
         houses_dict_list = []
@@ -579,6 +733,9 @@ def get_houses_list():
         for house in houses_list:
             houses_dict_list.append(house.to_basic_dict())
 
+        # 合并尚未写回的订单数
+        counters.merge_order_counts(houses_dict_list)
+
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="数据库查询失败")
@@ -592,23 +749,266 @@ def get_houses_list():
 
     # 判断用户请求页数总页数
     if page <= total_page:
-        # 构造redis_key
-        redis_key = 'houses_%s_%s_%s_%s' % (area_id, start_date_str, end_date_str, sort_key)
+        # 存储数据并设置有效期， 一次往返原子完成
+        try:
+            redis_scripts.hset_expire(redis_key, page, resp_json, conf.HOUSE_LIST_REDIS_EXPIRES)
+        except Exception as e:
+            current_app.logger.error(e)
+
+    # 返回结果
+    return resp_json
+
+
+@api.route('/houses/<int:house_id>/calendar', methods=['GET'])
+def get_house_calendar(house_id):
+    '''
+    获取房屋预订日历： 缓存-磁盘-缓存
+    1. 获取参数， 月数months和编码方式fmt
+    2. 校验参数
+    3. 从日历缓存中获取已预订的日期区间， 缓存不存在时从mysql加载
+    4. 合并区间， 截取展示窗口内的部分
+    5. 按照编码方式构造数据， ranges为合并后的区间， bitmap为按天的位图
+    6. 返回结果
+    :param house_id:
+    :return:
+    '''
+
+    # 获取参数
+    months = request.args.get("months", conf.HOUSE_CALENDAR_DEFAULT_MONTHS)
+    fmt = request.args.get("fmt", "ranges")
+
+    # 校验参数
+    try:
+        months = int(months)
+        assert 0 < months <= conf.HOUSE_CALENDAR_MAX_MONTHS
+        assert fmt in ("ranges", "bitmap")
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+
+    # 获取已预订的日期区间
+    try:
+        start, end, ranges = booking_calendar.get_calendar(house_id, months)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询预订日历失败")
+
+    # 构造数据
+    data = {
+        "start": start.strftime("%Y-%m-%d"),
+        "end": end.strftime("%Y-%m-%d"),
+        "fmt": fmt
+    }
+    if fmt == "ranges":
+        data["ranges"] = [[begin.strftime("%Y-%m-%d"), finish.strftime("%Y-%m-%d")] for begin, finish in ranges]
+    else:
+        data["days"] = (end - start).days + 1
+        data["bitmap"] = booking_calendar.encode_bitmap(ranges, start, data["days"])
+
+    # 返回结果
+    return jsonify(errno=RET.OK, errmsg="OK", data=data)
+
+
+@api.route('/houses/<int:house_id>/quote', methods=['GET', 'POST'])
+def get_house_quote(house_id):
+    '''
+    房屋预订报价
+    1. 获取参数， GET为单个日期区间sd/ed， POST为批量日期区间{"ranges": [[sd, ed], ...]}
+    2. 对日期参数进行格式化
+    3. 获取房屋的报价参数， 进程内缓存-详情缓存-mysql
+    4. 获取房屋已预订的日期区间
+    5. 逐个区间计算报价， 校验入住天数以及日期是否可订
+    6. 返回结果
+    :param house_id:
+    :return:
+    '''
+
+    # 获取参数
+    if request.method == 'GET':
+        date_ranges = [[request.args.get("sd", ""), request.args.get("ed", "")]]
+    else:
+        quote_data = request.get_json(silent=True)
+        date_ranges = quote_data.get("ranges") if isinstance(quote_data, dict) else None
+        if not date_ranges or not isinstance(date_ranges, list):
+            return jsonify(errno=RET.PARAMERR, errmsg="参数不存在")
+        if len(date_ranges) > conf.HOUSE_QUOTE_MAX_BATCH:
+            return jsonify(errno=RET.PARAMERR, errmsg="日期区间过多")
+
+    # 对日期格式化
+    try:
+        date_ranges = [(datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date(),
+                        datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date())
+                       for start_date_str, end_date_str in date_ranges]
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="日期参数错误")
+
+    # 获取报价参数， 已预订的日期区间
+    try:
+        house_pricing = pricing.get_pricing(house_id)
+        booked_ranges = booking_calendar.get_booked_ranges(house_id) if house_pricing else []
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询报价信息失败")
+
+    # 校验房屋存在
+    if not house_pricing:
+        return jsonify(errno=RET.NODATA, errmsg="房屋不存在")
+
+    # 逐个计算报价
+    quotes = []
+    for start_date, end_date in date_ranges:
+        house_quote = pricing.quote(house_pricing, start_date, end_date)
+        house_quote["available"] = not booking_calendar.overlaps(booked_ranges, start_date, end_date)
+        quotes.append(house_quote)
+
+    # 返回结果
+    if request.method == 'GET':
+        return jsonify(errno=RET.OK, errmsg="OK", data=quotes[0])
+    return jsonify(errno=RET.OK, errmsg="OK", data={"quotes": quotes})
+
+
+@api.route('/houses/facets', methods=['GET'])
+def get_houses_facets():
+    '''
+    获取房屋搜索的聚合数据： 各区域的房屋数， 单价直方图
+    1. 从redis中读取预先计算好的聚合数据， 不存在时全量计算
+    2. 返回结果
+    :return:
+    '''
+
+    try:
+        data = facets.get_facets()
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    return jsonify(errno=RET.OK, errmsg="OK", data=data)
 
-        # 为了保证有效期， 开启事务
-        pip = redis_store.pipeline()
 
+@api.route('/houses/suggest', methods=['GET'])
+def get_houses_suggest():
+    '''
+    搜索框的前缀联想
+    1. 获取参数q
+    2. 在进程内的有序索引中二分查找前缀
+    3. 返回结果
+    :return:
+    '''
+
+    # 获取参数
+    prefix = request.args.get("q", "")
+    if not prefix.strip():
+        return jsonify(errno=RET.OK, errmsg="OK", data=[])
+
+    # 查询前缀
+    try:
+        data = suggest.suggest_index.lookup(prefix)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    return jsonify(errno=RET.OK, errmsg="OK", data=data)
+
+
+@api.route('/houses/<int:house_id>/similar', methods=['GET'])
+def get_similar_houses(house_id):
+    '''
+    获取相似房屋
+    1. 读取离线任务计算好的相似房屋编号
+    2. 批量获取房屋基本信息缓存
+    3. 返回结果
+    :param house_id:
+    :return:
+    '''
+
+    try:
+        house_ids = similar.get_similar_ids(house_id)
+        houses_list = house_cache.get_basic_dicts(house_ids)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    return jsonify(errno=RET.OK, errmsg="OK", data={"houses": houses_list})
+
+
+@api.route('/user/houses/stats', methods=['GET'])
+@login_required
+def get_user_houses_stats():
+    '''
+    获取房东发布的房源的入住率和收入
+    1. 获取用户身份信息user_id
+    2. 获取参数， 统计的起止日期sd/ed， 默认最近HOUSE_STATS_DEFAULT_DAYS天， 可选的房屋编号hid
+    3. 校验参数
+    4. 从每日汇总表中按房屋汇总入住天数和收入
+    5. 如果指定了房屋， 额外返回该房屋的每日数据
+    6. 返回结果
+    :return:
+    '''
+
+    # 获取用户身份信息
+    user_id = g.user_id
+
+    # 获取参数
+    start_date_str = request.args.get("sd", "")
+    end_date_str = request.args.get("ed", "")
+    house_id = request.args.get("hid", "")
+
+    # 校验参数
+    try:
+        end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str \
+            else datetime.date.today()
+        start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str \
+            else end_date - datetime.timedelta(days=conf.HOUSE_STATS_DEFAULT_DAYS - 1)
+        assert start_date <= end_date
+        assert (end_date - start_date).days < conf.HOUSE_STATS_MAX_DAYS
+        house_id = int(house_id) if house_id else None
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+
+    total_days = (end_date - start_date).days + 1
+
+    # 按房屋汇总
+    try:
+        occupied_days = func.sum(case([(HouseDailyStat.occupied > 0, 1)], else_=0))
+        rows = db.session.query(House.id, House.title, occupied_days, func.sum(HouseDailyStat.revenue)) \
+            .outerjoin(HouseDailyStat, and_(HouseDailyStat.house_id == House.id,
+                                            HouseDailyStat.stat_date.between(start_date, end_date))) \
+            .filter(House.user_id == user_id) \
+            .group_by(House.id, House.title).all()
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    houses_list = []
+    for row_house_id, title, occupied, revenue in rows:
+        houses_list.append({
+            "house_id": row_house_id,
+            "title": title,
+            "occupied_days": int(occupied or 0),
+            "occupancy": round(float(occupied or 0) / total_days, 4),
+            "revenue": int(revenue or 0)
+        })
+
+    data = {
+        "start_date": start_date.strftime("%Y-%m-%d"),
+        "end_date": end_date.strftime("%Y-%m-%d"),
+        "houses": houses_list
+    }
+
+    # 指定了房屋时返回每日数据
+    if house_id is not None:
+        if house_id not in [house["house_id"] for house in houses_list]:
+            return jsonify(errno=RET.ROLEERR, errmsg="无效操作")
         try:
-            # 开启事务
-            pip.multi()
-            # 存储数据
-            pip.hset(redis_key, page, resp_json)
-            # 设置时间
-            pip.expire(redis_key, constants.HOME_PAGE_DATA_REDIS_EXPIRES)
-            # 执行事务
-            pip.execute()
+            stats = HouseDailyStat.query.filter(HouseDailyStat.house_id == house_id,
+                                                HouseDailyStat.stat_date.between(start_date, end_date)) \
+                .order_by(HouseDailyStat.stat_date.asc()).all()
         except Exception as e:
             current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="查询失败")
+        data["daily"] = [stat.to_dict() for stat in stats]
 
     # 返回结果
-    return resp_json
+    return jsonify(errno=RET.OK, errmsg="OK", data=data)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# 导入蓝图对象
+from . import api
+
+# 导入flask内置函数对象
+from flask import jsonify, g
+
+# 导入自定义状态码
+from FlaskFrame.utils.response_code import RET
+
+# 导入登陆装饰器
+from FlaskFrame.utils.commons import login_required
+
+# 导入配置常量
+from FlaskFrame.config import conf
+
+# 导入数据库连接池和redis的监控
+from FlaskFrame.frame import db_pool, redis_client
+
+
+@api.route('/metrics', methods=['GET'])
+@login_required
+def get_metrics():
+    '''
+    获取当前进程的运行指标
+    1. 校验用户是否为运营人员
+    2. 返回数据库连接池的指标， 按接口统计的连接占用时长， 以及redis命令的耗时
+    :return:
+    '''
+
+    # 只有运营人员可以查看
+    if g.user_id not in conf.METRICS_USER_IDS:
+        return jsonify(errno=RET.ROLEERR, errmsg="没有查看权限")
+
+    return jsonify(errno=RET.OK, errmsg="OK", data={"db": db_pool.metrics(), "redis": redis_client.metrics()})
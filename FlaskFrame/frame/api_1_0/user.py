@@ -33,6 +33,12 @@ from FlaskFrame.utils import login_required
 # 导入七牛云接口
 from FlaskFrame.utils.image_storage import storage
 
+# 导入配置常量
+from FlaskFrame.config import conf
+
+# 导入房屋基本信息缓存， 数据库操作范围， redis脚本， 验证码池
+from FlaskFrame.frame import house_cache, db_scope, redis_scripts, captcha_pool
+
 from FlaskFrame.utils.logger import Log
 
 
@@ -44,30 +50,37 @@ logger = Log('user').logger
 def generate_image_code(image_code_id):
     '''
     *生成验证码*
-    1. 调用验证码生成函数
-    2. 将验证码保存在redis缓存中
+    1. 从预生成的验证码池中取出验证码， 同时绑定到image_code_id
+    2. 池为空时调用验证码生成函数， 将验证码保存在redis缓存中
     3. 返回前端
     4. 设置头信息
     :param image_code_id:
     :return:
     '''
 
-    # 调用验证码生成函数
-    name, text, image = captcha.generate_captcha()  # 调用验证码
-
-    # 试着将验证码保存到redis缓存中
+    # 从预生成的验证码池中取出一个， 同时绑定到该编号
     try:
-        redis_store.setex("ImageCode_" + image_code_id, constants.IMAGE_CODE_REDIS_EXPIRES, text)
-        logger.info("写入缓存验证码成功")
+        image = captcha_pool.pop_captcha("ImageCode_" + image_code_id, conf.IMAGE_CODE_REDIS_EXPIRES)
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="查询失败")
+        image = None
 
-    # 返回结果
+    # 验证码池为空时当场生成， 保存到redis缓存中
+    if image:
+        logger.info("使用预生成的验证码")
     else:
-        response = make_response(image)
-        response.headers["Content-Type"] = "image/jpg"
-        return response
+        name, text, image = captcha.generate_captcha()  # 调用验证码
+        try:
+            redis_store.setex("ImageCode_" + image_code_id, conf.IMAGE_CODE_REDIS_EXPIRES, text)
+            logger.info("写入缓存验证码成功")
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="查询失败")
+
+    # 返回结果
+    response = make_response(image)
+    response.headers["Content-Type"] = "image/jpg"
+    return response
 
 
 @api.route('/smscode/<mobile>', methods=["GET"])
@@ -77,9 +90,9 @@ def send_msg_code(mobile):
     1. 获取参数（mobile, text, id)
     2. 校验参数的完整性
     3. 校验手机号的正则
-    4. 从redis缓存中获取真实的图片验证码
+    4. 用lua脚本在redis中比较并删除真实的图片验证码， 一次往返原子完成
     5. 判断真实验证码吗的有效期
-    6. 从redis缓存中删除真实验证码
+    6. 无论是否一致， 真实验证码都已删除
     7. 对比验证码的正确性
     8. 生成短信随机数
     9. 保存随机码到redis缓存
@@ -103,25 +116,20 @@ def send_msg_code(mobile):
     if not re.match(r'1[3456789]\d{9}$', mobile):
         return jsonify(errno=RET.PARAMERR, errmsg="手机号格式不正确")
 
-    # 获取真实验证码
+    # 比较验证码并删除， 图片验证码只能使用一次， 一次往返原子完成
     try:
-        real_image_code = redis_store.get("ImageCode_" + image_code_id)
+        result = redis_scripts.compare_and_delete("ImageCode_" + image_code_id, image_code,
+                                                  ignore_case=True, delete_on_mismatch=True)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="获取验证码斯失败")
 
     # 校验获取验证码
-    if not real_image_code:
+    if result == 0:
         return jsonify(errno=RET.NODATA, errmsg="验证码过期")
 
-    # 删除验证码
-    try:
-        redis_store.delete("ImageCode_" + image_code_id)
-    except Exception as e:
-        current_app.logger.error(e)
-
     # 比较验证码是否一致
-    if real_image_code.lower() != image_code.lower():
+    if result < 0:
         return jsonify(errno=RET.DATAERR, errmsg="验证码不正确")
 
     # 生成短信随机码
@@ -134,9 +142,10 @@ def send_msg_code(mobile):
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="保存随机数失败")
 
-    # 判断手机号是否注册
+    # 判断手机号是否注册， 查询后立即归还连接
     try:
-        user = User.query.filter_by(mobile=mobile).first()
+        with db_scope.db_unit():
+            user = User.query.filter_by(mobile=mobile).first()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="查询失败")
@@ -144,11 +153,12 @@ def send_msg_code(mobile):
         if user:
             return jsonify(errno=RET.DBERR, errmsg="手机号已经注册")
 
-    # 调用接口， 发送激活短信
+    # 调用接口， 发送激活短信， 发送期间不占用数据库连接
     try:
-        ccp = sms.CCP()
-        # 保存发送的结果
-        result = ccp.send_template_sms(mobile, [sms_code, constants.SMS_CODE_REDIS_EXPIRES / 60], 1)
+        with db_scope.outbound("sms"):
+            ccp = sms.CCP()
+            # 保存发送的结果
+            result = ccp.send_template_sms(mobile, [sms_code, constants.SMS_CODE_REDIS_EXPIRES / 60], 1)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.THIRDERR, errmsg="发送短信异常")
@@ -169,10 +179,10 @@ def register():
     3. 进一步获取参数信息 user_data.get("")
     4. 校验参数的完整性 all()
     5. 校验手机号的正则
-    6. 获取本地存储的真实的短信验证码
+    6. 用lua脚本比较真实的短信验证码， 一致时删除， 一次往返原子完成
     7. 校验短信验证码的有效期
     8. 对比验证码是否一致
-    9. 删除redis缓存里的短信验证码
+    9. 一致时redis缓存里的短信验证码已经删除
     10. 判断是否注册
     11. 保存用户信息
     12. 加密密码信息 user.password = password
@@ -202,27 +212,21 @@ def register():
     if not re.match(r'1[3456789]\d{9}', mobile):
         return jsonify(errno=RET.PARAMERR, errmsg="手机号格式不正确")
 
-    # 获取本地存储的真实验证码
+    # 比较短信验证码， 一致时删除， 一次往返原子完成
     try:
-        real_sms_code = redis_store.get("SMSCode_" + mobile)
+        result = redis_scripts.compare_and_delete("SMSCode_" + mobile, str(smscode))
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="获取失败")
 
     # 判断获取的结果
-    if not real_sms_code:
+    if result == 0:
         return jsonify(errno=RET.NODATA, errmsg="短信验证码失效")
 
     # 比较短信验证码是否一致
-    if real_sms_code != str(smscode):
+    if result < 0:
         return jsonify(errno=RET.DATAERR, errmsg="验证码不正确")
 
-    # 删除redis中存储的短信验证码
-    try:
-        redis_store.delete("SMSCode_" + mobile)
-    except Exception as e:
-        current_app.logger.error(e)
-
     # 判断是否注册
     try:
         user = User.query.filter_by(mobile=mobile).first()
@@ -422,9 +426,10 @@ def set_user_avatar():
     # 读取图片数据
     avatar_data = avatar.read()
 
-    # 调用七牛云接口
+    # 调用七牛云接口， 上传期间不占用数据库连接
     try:
-        image_name = storage(avatar_data)
+        with db_scope.outbound("qiniu"):
+            image_name = storage(avatar_data)
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.THIRDERR, errmsg="接口异常")
@@ -440,6 +445,12 @@ def set_user_avatar():
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="数据库异常")
 
+    # 房源列表中带有房东头像， 删除房源列表缓存
+    try:
+        house_cache.invalidate_user_houses(user_id)
+    except Exception as e:
+        current_app.logger.error(e)
+
     # 拼接返回给前段的图片绝对路径
     image_url = constants.QINIU_DOMIN_PREFIX + image_name
 
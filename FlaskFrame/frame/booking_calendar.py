@@ -0,0 +1,187 @@
+# -*- coding:utf-8 -*-
+"""
+房屋预订日历
+每个房屋在redis中保存一个hash: house_calendar_<house_id>，field为订单编号，value为"起始日期,结束日期"，
+订单新增或者状态变化时只增删对应的field，读取时把日期区间合并后返回，避免每次请求都扫描订单表
+"""
+
+import calendar
+import datetime
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, redis_scripts
+from FlaskFrame.frame.events import on_order_change
+from FlaskFrame.frame.models import Order
+
+
+# 占用房屋日期的订单状态，已取消和已拒单的订单不再占用
+ACTIVE_ORDER_STATUS = ("WAIT_ACCEPT", "WAIT_PAYMENT", "PAID", "WAIT_COMMENT", "COMPLETE")
+
+# 空日历的占位field，保证没有订单的房屋也能命中缓存
+_PLACEHOLDER = "-"
+
+_DATE_FMT = "%Y-%m-%d"
+
+# 日历存在时才写入订单，避免在检查和写入之间日历过期，留下只有一个订单的不完整日历
+# KEYS[1] 日历的键， ARGV[1] 订单编号， ARGV[2] 日期区间，为空时删除订单
+_update_if_exists = redis_scripts.register("calendar_update_if_exists", """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[2] == '' then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+else
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+return 1
+""")
+
+
+def _calendar_key(house_id):
+    return "house_calendar_%s" % house_id
+
+
+def _to_str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _to_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def add_months(date, months):
+    """日期加上若干个月，超出月末的日期取当月最后一天"""
+
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return datetime.date(year, month, day)
+
+
+def merge_ranges(ranges):
+    """
+    合并日期区间，区间为闭区间(起始日期, 结束日期)，相交或者首尾相连的区间合并为一个
+    :param ranges: [(date, date), ...]
+    :return: 按起始日期排序的合并结果
+    """
+
+    merged = []
+    for begin, end in sorted(ranges):
+        if merged and begin <= merged[-1][1] + datetime.timedelta(days=1):
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([begin, end])
+    return [(begin, end) for begin, end in merged]
+
+
+def clip_ranges(ranges, start, end):
+    """截取落在[start, end]之间的部分"""
+
+    clipped = []
+    for begin, finish in ranges:
+        if finish < start or begin > end:
+            continue
+        clipped.append((max(begin, start), min(finish, end)))
+    return clipped
+
+
+def encode_bitmap(ranges, start, days):
+    """
+    把日期区间编码为位图，第i位为1表示 start + i 天已被预订
+    :return: 十六进制字符串，低位在前的字节序
+    """
+
+    bitmap = bytearray((days + 7) // 8)
+    for begin, end in ranges:
+        first = max((begin - start).days, 0)
+        last = min((end - start).days, days - 1)
+        for i in range(first, last + 1):
+            bitmap[i // 8] |= 1 << (i % 8)
+    return "".join("%02x" % b for b in bitmap)
+
+
+def _load_from_db(house_id):
+    """从mysql加载房屋未结束的有效订单，写入redis缓存"""
+
+    today = datetime.date.today()
+    orders = Order.query.with_entities(Order.id, Order.begin_date, Order.end_date) \
+        .filter(Order.house_id == house_id,
+                Order.status.in_(ACTIVE_ORDER_STATUS),
+                Order.end_date >= today).all()
+
+    mapping = {_PLACEHOLDER: ""}
+    ranges = []
+    for order_id, begin_date, end_date in orders:
+        begin, end = _to_date(begin_date), _to_date(end_date)
+        mapping[order_id] = "%s,%s" % (begin.strftime(_DATE_FMT), end.strftime(_DATE_FMT))
+        ranges.append((begin, end))
+
+    key = _calendar_key(house_id)
+    pip = redis_store.pipeline()
+    pip.delete(key)
+    pip.hmset(key, mapping)
+    pip.expire(key, conf.HOUSE_CALENDAR_REDIS_EXPIRES)
+    pip.execute()
+
+    return ranges
+
+
+def get_booked_ranges(house_id):
+    """
+    获取房屋已被预订的日期区间(未合并)
+    缓存不存在时从mysql加载
+    """
+
+    cached = redis_store.hgetall(_calendar_key(house_id))
+    if not cached:
+        return _load_from_db(house_id)
+
+    ranges = []
+    for field, value in cached.items():
+        if _to_str(field) == _PLACEHOLDER:
+            continue
+        begin, end = _to_str(value).split(",")
+        ranges.append((datetime.datetime.strptime(begin, _DATE_FMT).date(),
+                       datetime.datetime.strptime(end, _DATE_FMT).date()))
+    return ranges
+
+
+def get_calendar(house_id, months):
+    """
+    获取房屋从今天开始months个月内已被预订的日期区间(已合并)
+    :return: (窗口起始日期, 窗口结束日期, 合并后的区间)
+    """
+
+    start = datetime.date.today()
+    end = add_months(start, months) - datetime.timedelta(days=1)
+    ranges = clip_ranges(merge_ranges(get_booked_ranges(house_id)), start, end)
+    return start, end, ranges
+
+
+def overlaps(ranges, begin_date, end_date):
+    """判断[begin_date, end_date]是否与ranges中的某个区间相交"""
+
+    begin_date, end_date = _to_date(begin_date), _to_date(end_date)
+    for begin, end in ranges:
+        if begin <= end_date and end >= begin_date:
+            return True
+    return False
+
+
+def is_available(house_id, begin_date, end_date):
+    """判断房屋在[begin_date, end_date]之间是否没有被预订"""
+
+    return not overlaps(get_booked_ranges(house_id), begin_date, end_date)
+
+
+@on_order_change
+def _update_calendar(order_info, old_status):
+    """订单变更后增量更新日历缓存，缓存不存在时不处理，等待下次读取时加载"""
+
+    value = ""
+    if order_info["status"] in ACTIVE_ORDER_STATUS:
+        value = "%s,%s" % (_to_date(order_info["begin_date"]).strftime(_DATE_FMT),
+                           _to_date(order_info["end_date"]).strftime(_DATE_FMT))
+    _update_if_exists([_calendar_key(order_info["house_id"])], [order_info["order_id"], value])
@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+"""
+预生成的图片验证码池
+多进程预先生成验证码，以 "文本|jpeg" 存入redis列表captcha_pool，接口用lua脚本一次往返弹出一个并绑定到ImageCode_<id>，
+请求线程不再绘制图片。池中数量低于CAPTCHA_POOL_LOW_WATERMARK时补充到CAPTCHA_POOL_SIZE，
+补充由manage.py run_captcha_pool或应用内的后台线程执行，同一时间只有一个进程在补充；池为空时接口退回到当场生成
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, redis_scripts
+from FlaskFrame.utils.captcha.captcha import captcha
+
+
+CAPTCHA_POOL_KEY = "captcha_pool"
+
+# 补充验证码池的锁， 防止多个进程同时补充
+CAPTCHA_POOL_LOCK = "captcha_pool_lock"
+
+# 弹出一个验证码， 把文本绑定到图片验证码编号， 返回jpeg数据
+# KEYS[1] 验证码池， KEYS[2] ImageCode_<id>， ARGV[1] 验证码有效期
+_pop_captcha = redis_scripts.register("pop_captcha", """
+local item = redis.call('LPOP', KEYS[1])
+if not item then
+    return false
+end
+local sep = string.find(item, '|', 1, true)
+redis.call('SETEX', KEYS[2], ARGV[1], string.sub(item, 1, sep - 1))
+return string.sub(item, sep + 1)
+""")
+
+
+def pop_captcha(image_code_key, expires):
+    """
+    从验证码池中取出一个验证码
+    :return: jpeg数据， 池为空时返回None
+    """
+
+    return _pop_captcha([CAPTCHA_POOL_KEY, image_code_key], [int(expires)]) or None
+
+
+def _render(_):
+    """在工作进程中生成一个验证码"""
+
+    name, text, image = captcha.generate_captcha()
+    return text.encode("utf-8") + b"|" + image
+
+
+_workers = []
+
+
+def _worker_pool():
+    if not _workers:
+        _workers.append(multiprocessing.Pool(conf.CAPTCHA_POOL_WORKERS))
+    return _workers[0]
+
+
+def refill_once():
+    """
+    验证码池低于低水位时补充到CAPTCHA_POOL_SIZE
+    :return: 补充的数量
+    """
+
+    size = redis_store.llen(CAPTCHA_POOL_KEY)
+    if size >= conf.CAPTCHA_POOL_LOW_WATERMARK:
+        return 0
+
+    token = redis_scripts.acquire_lock(CAPTCHA_POOL_LOCK, conf.CAPTCHA_POOL_LOCK_SECONDS)
+    if not token:
+        return 0
+
+    count = 0
+    try:
+        missing = conf.CAPTCHA_POOL_SIZE - size
+        batch = []
+        for item in _worker_pool().imap_unordered(_render, range(missing), chunksize=conf.CAPTCHA_POOL_BATCH):
+            batch.append(item)
+            if len(batch) >= conf.CAPTCHA_POOL_BATCH:
+                redis_store.rpush(CAPTCHA_POOL_KEY, *batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            redis_store.rpush(CAPTCHA_POOL_KEY, *batch)
+            count += len(batch)
+    finally:
+        redis_scripts.release_lock(CAPTCHA_POOL_LOCK, token)
+    return count
+
+
+def run_forever(interval=None):
+    """定时检查并补充验证码池"""
+
+    interval = interval or conf.CAPTCHA_POOL_CHECK_SECONDS
+    while True:
+        try:
+            refill_once()
+        except Exception as e:
+            logging.error(e)
+        time.sleep(interval)
+
+
+def in_app():
+    """是否在web进程内补充验证码池"""
+
+    return conf.CAPTCHA_POOL_IN_APP
+
+
+def start_refiller(interval=None):
+    """启动补充验证码池的后台线程"""
+
+    thread = threading.Thread(target=run_forever, args=(interval,), name="captcha-pool-refiller")
+    thread.daemon = True
+    thread.start()
+    return thread
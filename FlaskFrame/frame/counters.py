@@ -0,0 +1,225 @@
+# -*- coding:utf-8 -*-
+"""
+房屋成交订单数的写回计数器
+订单完成时只在redis的hash里HINCRBY累加增量，由后台线程定时把增量批量UPDATE到mysql，
+避免热门房屋的同一行被频繁更新。读取时把mysql中的值和redis里尚未写回的增量合并
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy import bindparam, func
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, redis_scripts, db, house_cache
+from FlaskFrame.frame.events import on_order_change
+from FlaskFrame.frame.models import House, Order
+
+
+# 累加中的增量
+DELTA_KEY = "house_order_count_delta"
+
+# 正在写回mysql的增量，写回失败时保留，下次刷新时优先处理
+FLUSHING_KEY = "house_order_count_flushing"
+
+# 刷新锁，多个进程同时刷新时只有一个生效，重新计算订单数期间也持有
+FLUSH_LOCK_KEY = "house_order_count_flush_lock"
+
+# 重新计算订单数时被丢弃的增量
+DISCARDED_KEY = "house_order_count_discarded"
+
+
+def incr_order_count(house_id, amount=1):
+    """累加房屋的成交订单数"""
+
+    redis_store.hincrby(DELTA_KEY, house_id, amount)
+
+
+def get_pending_counts(house_ids):
+    """
+    获取房屋尚未写回mysql的增量
+    :return: {house_id: 增量}
+    """
+
+    house_ids = list(house_ids)
+    if not house_ids:
+        return {}
+
+    pip = redis_store.pipeline(transaction=False)
+    pip.hmget(DELTA_KEY, house_ids)
+    pip.hmget(FLUSHING_KEY, house_ids)
+    deltas, flushing = pip.execute()
+
+    pending = {}
+    for house_id, delta, flush in zip(house_ids, deltas, flushing):
+        total = int(delta or 0) + int(flush or 0)
+        if total:
+            pending[house_id] = total
+    return pending
+
+
+def merged_order_count(house_id, order_count):
+    """mysql中的订单数加上未写回的增量"""
+
+    return (order_count or 0) + get_pending_counts([house_id]).get(house_id, 0)
+
+
+def merge_order_counts(house_dicts):
+    """为to_basic_dict()得到的房屋数据合并未写回的订单数增量"""
+
+    try:
+        pending = get_pending_counts([house["house_id"] for house in house_dicts])
+    except Exception as e:
+        logging.error(e)
+        return house_dicts
+
+    for house in house_dicts:
+        house["order_count"] = (house["order_count"] or 0) + pending.get(house["house_id"], 0)
+    return house_dicts
+
+
+def _apply(deltas):
+    """把增量批量写回mysql"""
+
+    rows = [{"hid": int(house_id), "delta": int(delta)} for house_id, delta in deltas.items() if int(delta)]
+    if not rows:
+        return
+
+    stmt = House.__table__.update() \
+        .where(House.__table__.c.id == bindparam("hid")) \
+        .values(order_count=House.__table__.c.order_count + bindparam("delta"))
+    try:
+        for i in range(0, len(rows), conf.ORDER_COUNT_FLUSH_BATCH):
+            db.session.execute(stmt, rows[i:i + conf.ORDER_COUNT_FLUSH_BATCH])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # 基本信息缓存中的订单数是写回之前的值， 增量删除后不再合并， 需要删除缓存
+    _invalidate_basic(rows)
+
+
+def _invalidate_basic(rows):
+    for i in range(0, len(rows), conf.ORDER_COUNT_FLUSH_BATCH):
+        house_cache.invalidate_basic(*[row["hid"] for row in rows[i:i + conf.ORDER_COUNT_FLUSH_BATCH]])
+
+
+def flush_order_counts():
+    """
+    把redis中累加的增量写回mysql
+    1. 获取刷新锁
+    2. 如果有上次写回失败的增量， 先写回
+    3. 把累加中的增量改名为写回中， 之后的累加写入新的hash
+    4. 批量UPDATE， 成功后删除写回中的增量
+    :return: 写回的房屋数
+    """
+
+    token = redis_scripts.acquire_lock(FLUSH_LOCK_KEY, conf.ORDER_COUNT_FLUSH_LOCK_EXPIRES)
+    if not token:
+        return 0
+
+    try:
+        if not redis_store.exists(FLUSHING_KEY):
+            if not redis_store.exists(DELTA_KEY):
+                return 0
+            redis_store.rename(DELTA_KEY, FLUSHING_KEY)
+
+        deltas = redis_store.hgetall(FLUSHING_KEY)
+        _apply(deltas)
+        redis_store.delete(FLUSHING_KEY)
+        return len(deltas)
+    finally:
+        redis_scripts.release_lock(FLUSH_LOCK_KEY, token)
+
+
+def _wait_flush_lock(expires, wait):
+    """等待并获取刷新锁， 超时返回None"""
+
+    deadline = time.time() + wait
+    while True:
+        token = redis_scripts.acquire_lock(FLUSH_LOCK_KEY, expires)
+        if token or time.time() >= deadline:
+            return token
+        time.sleep(0.5)
+
+
+def reconcile_order_counts():
+    """
+    根据已完成的订单重新计算所有房屋的订单数， 并丢弃redis中的增量
+    1. 获取刷新锁， 期间定时写回不会把增量再加到重新计算的结果上
+    2. 先把累加中的增量改名丢弃， 再统计订单， 之后完成的订单累加到新的hash， 下次写回时加上
+    3. 批量UPDATE
+    :return: 更新的房屋数
+    """
+
+    token = _wait_flush_lock(conf.ORDER_COUNT_RECONCILE_LOCK_EXPIRES, conf.ORDER_COUNT_RECONCILE_LOCK_WAIT)
+    if not token:
+        raise RuntimeError("order count flush lock is busy")
+
+    try:
+        # 上次写回失败的增量已经包含在统计结果中
+        redis_store.delete(FLUSHING_KEY)
+        if redis_store.exists(DELTA_KEY):
+            redis_store.rename(DELTA_KEY, DISCARDED_KEY)
+
+        counts = dict(db.session.query(Order.house_id, func.count(Order.id))
+                      .filter(Order.status == "COMPLETE")
+                      .group_by(Order.house_id).all())
+
+        stmt = House.__table__.update() \
+            .where(House.__table__.c.id == bindparam("hid")) \
+            .values(order_count=bindparam("count"))
+        house_ids = [house_id for house_id, in db.session.query(House.id).all()]
+        rows = [{"hid": house_id, "count": counts.get(house_id, 0)} for house_id in house_ids]
+        try:
+            for i in range(0, len(rows), conf.ORDER_COUNT_FLUSH_BATCH):
+                db.session.execute(stmt, rows[i:i + conf.ORDER_COUNT_FLUSH_BATCH])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        redis_store.delete(DISCARDED_KEY)
+        _invalidate_basic(rows)
+        return len(rows)
+    finally:
+        redis_scripts.release_lock(FLUSH_LOCK_KEY, token)
+
+
+def in_app():
+    """是否在web进程内定时写回增量"""
+
+    return conf.ORDER_COUNT_FLUSH_IN_APP
+
+
+def start_flusher(app, interval=None):
+    """启动定时写回增量的后台线程"""
+
+    interval = interval or conf.ORDER_COUNT_FLUSH_INTERVAL
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    flush_order_counts()
+                except Exception as e:
+                    logging.error(e)
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name="order-count-flusher")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+@on_order_change
+def _count_completed_order(order_info, old_status):
+    """订单变为已完成时累加， 从已完成变为其他状态时扣减"""
+
+    if order_info["status"] == "COMPLETE" and old_status != "COMPLETE":
+        incr_order_count(order_info["house_id"], 1)
+    elif order_info["status"] != "COMPLETE" and old_status == "COMPLETE":
+        incr_order_count(order_info["house_id"], -1)
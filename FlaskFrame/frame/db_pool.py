@@ -0,0 +1,197 @@
+# -*- coding:utf-8 -*-
+"""
+数据库连接池监控
+mysql引擎使用TimedQueuePool：记录每次取连接的等待时间、连接的存活时间、连接池的占用数和溢出数，
+连接归还时记录本次占用的时长并按接口汇总，用来找出在调用七牛云、短信等外部接口时仍然占着连接的接口。
+超过阈值时记录warning日志，指标可以通过metrics()获取
+"""
+
+import logging
+import threading
+import time
+
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from FlaskFrame.config import conf
+
+
+class PoolMetrics(object):
+    """连接池的累计指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._endpoints = {}
+
+    def _pool_stats(self, label):
+        return self._pools.setdefault(label, {
+            "checkouts": 0, "wait_total": 0.0, "wait_max": 0.0, "timeouts": 0,
+            "age_max": 0.0, "hold_total": 0.0, "hold_max": 0.0, "pre_ping_failures": 0,
+            "outbound_checkouts": 0,
+        })
+
+    def record_wait(self, label, wait, timeout=False):
+        with self._lock:
+            stats = self._pool_stats(label)
+            if timeout:
+                stats["timeouts"] += 1
+                return
+            stats["checkouts"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+
+    def record_age(self, label, age):
+        with self._lock:
+            stats = self._pool_stats(label)
+            stats["age_max"] = max(stats["age_max"], age)
+
+    def record_pre_ping_failure(self, label):
+        with self._lock:
+            self._pool_stats(label)["pre_ping_failures"] += 1
+
+    def record_outbound_checkout(self, label):
+        with self._lock:
+            self._pool_stats(label)["outbound_checkouts"] += 1
+
+    def record_hold(self, label, endpoint, hold):
+        with self._lock:
+            stats = self._pool_stats(label)
+            stats["hold_total"] += hold
+            stats["hold_max"] = max(stats["hold_max"], hold)
+
+            endpoint_stats = self._endpoints.setdefault(endpoint, {"count": 0, "hold_total": 0.0, "hold_max": 0.0})
+            endpoint_stats["count"] += 1
+            endpoint_stats["hold_total"] += hold
+            endpoint_stats["hold_max"] = max(endpoint_stats["hold_max"], hold)
+
+    def snapshot(self, pools):
+        """
+        :param pools: {label: pool}， 用于读取当前的占用数和溢出数
+        :return: {"pools": {label: 指标}, "endpoints": {endpoint: 连接占用时长}}
+        """
+
+        with self._lock:
+            result = {"pools": {}, "endpoints": dict((key, dict(value)) for key, value in self._endpoints.items())}
+            for label, pool in pools.items():
+                stats = dict(self._pool_stats(label))
+                stats.update({
+                    "size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "overflow": max(pool.overflow(), 0),
+                    "max_overflow": pool._max_overflow,
+                })
+                result["pools"][label] = stats
+        return result
+
+
+pool_metrics = PoolMetrics()
+
+# 已创建的连接池， 用于读取实时的占用数
+_pools = {}
+
+
+class TimedQueuePool(QueuePool):
+    """记录取连接等待时间和连接占用情况的连接池"""
+
+    label = "default"
+    pre_ping = False
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        _pools[self.label] = self
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            record = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            pool_metrics.record_wait(self.label, time.time() - start, timeout=True)
+            logging.warning("db pool %s checkout timeout, %s" % (self.label, self.status()))
+            raise
+
+        wait = time.time() - start
+        pool_metrics.record_wait(self.label, wait)
+        if wait > conf.DB_POOL_WAIT_WARN_SECONDS:
+            logging.warning("db pool %s checkout waited %.3fs, %s" % (self.label, wait, self.status()))
+
+        in_use = self.checkedout()
+        limit = self.size() + self._max_overflow
+        if limit > 0 and float(in_use) / limit >= conf.DB_POOL_USAGE_WARN_RATIO:
+            logging.warning("db pool %s usage %s/%s" % (self.label, in_use, limit))
+        return record
+
+
+def _on_connect(dbapi_connection, connection_record):
+    connection_record.info["created_at"] = time.time()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool = connection_proxy._pool
+    now = time.time()
+
+    # 使用前检查连接是否可用， 不可用时连接池会丢弃该连接并重新建立
+    if pool.pre_ping:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception:
+            pool_metrics.record_pre_ping_failure(pool.label)
+            raise exc.DisconnectionError()
+        finally:
+            cursor.close()
+
+    pool_metrics.record_age(pool.label, now - connection_record.info.get("created_at", now))
+
+    # 连接在请求上下文弹出之后才归还， 取连接时记下接口名
+    connection_record.info["checkout_at"] = now
+    connection_record.info["checkout_label"] = pool.label
+    endpoint = (request.endpoint or request.path) if has_request_context() else "-"
+    connection_record.info["checkout_endpoint"] = endpoint
+
+    # 调用外部接口期间不应该占用连接， 见db_scope.outbound
+    outbound = g.get("db_outbound") if has_app_context() else None
+    if outbound:
+        pool_metrics.record_outbound_checkout(pool.label)
+        logging.warning("db connection checked out by %s during %s call" % (endpoint, outbound))
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    checkout_at = connection_record.info.pop("checkout_at", None)
+    if checkout_at is None:
+        return
+
+    hold = time.time() - checkout_at
+    endpoint = connection_record.info.pop("checkout_endpoint", "-")
+    pool_metrics.record_hold(connection_record.info.pop("checkout_label", "default"), endpoint, hold)
+
+    if hold > conf.DB_POOL_HOLD_WARN_SECONDS:
+        logging.warning("db connection held %.3fs by %s" % (hold, endpoint))
+
+
+def pool_class(label, pre_ping):
+    """生成带有名字的连接池类， 每个数据库(主库/从库)单独统计"""
+
+    return type("TimedQueuePool", (TimedQueuePool,), {"label": label, "pre_ping": pre_ping})
+
+
+def apply_pool_options(app, info, options):
+    """为mysql引擎设置连接池类， 连接池的大小、回收时间、超时等参数由flask-sqlalchemy从Config中读取"""
+
+    if not info.drivername.startswith("mysql"):
+        return
+    label = "%s/%s" % (info.host, info.database)
+    options["poolclass"] = pool_class(label, app.config.get("SQLALCHEMY_POOL_PRE_PING", False))
+
+
+def metrics():
+    """当前进程的连接池指标"""
+
+    return pool_metrics.snapshot(_pools)
+
+
+# 对所有TimedQueuePool注册连接池事件
+event.listen(TimedQueuePool, "connect", _on_connect)
+event.listen(TimedQueuePool, "checkout", _on_checkout)
+event.listen(TimedQueuePool, "checkin", _on_checkin)
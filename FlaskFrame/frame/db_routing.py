@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+"""
+数据库读写分离
+SQLALCHEMY_REPLICA_BINDS中列出的SQLALCHEMY_BINDS作为只读从库：GET/HEAD请求中的SELECT语句随机发往一个健康的从库，
+flush、INSERT/UPDATE/DELETE以及其他请求都使用主库。
+一个请求写入数据库之后，该请求剩余的查询以及该用户随后DB_REPLICA_STICKY_SECONDS秒内的请求都使用主库，保证读到自己的写入。
+后台线程定时检查从库的连通性和复制延迟，不健康的从库暂停使用，所有从库都不可用时回退到主库。
+检查复制延迟需要从库账号有REPLICATION CLIENT权限: GRANT REPLICATION CLIENT ON *.* TO '<user>'@'<host>';
+没有该权限时只检查连通性，复制延迟视为未知，并记录一次警告
+"""
+
+import logging
+import random
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.expression import SelectBase, UpdateBase
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame.db_pool import apply_pool_options
+
+
+class ReplicaHealth(object):
+    """从库的健康状态， 记录每个从库暂停使用的截止时间"""
+
+    def __init__(self):
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def mark_down(self, bind, seconds=None):
+        with self._lock:
+            self._down_until[bind] = time.time() + (seconds or conf.DB_REPLICA_DOWN_SECONDS)
+        logging.warning("replica %s marked down" % bind)
+
+    def mark_up(self, bind):
+        with self._lock:
+            self._down_until.pop(bind, None)
+
+    def healthy(self, binds):
+        now = time.time()
+        return [bind for bind in binds if self._down_until.get(bind, 0) <= now]
+
+
+replica_health = ReplicaHealth()
+
+
+def _mark_written():
+    if has_request_context():
+        g.db_written = True
+        g.db_replica = None
+
+
+class RoutingSession(SignallingSession):
+    """只读查询可以发往从库的会话"""
+
+    def __init__(self, db, **options):
+        self._routing_db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            _mark_written()
+        elif isinstance(clause, SelectBase) and not self._flushing and has_request_context():
+            bind = g.get("db_replica")
+            if bind:
+                return self._routing_db.get_engine(self.app, bind=bind)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(session, flush_context):
+    _mark_written()
+
+
+@event.listens_for(RoutingSession, "after_bulk_update")
+def _after_bulk_update(update_context):
+    _mark_written()
+
+
+@event.listens_for(RoutingSession, "after_bulk_delete")
+def _after_bulk_delete(delete_context):
+    _mark_written()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """使用RoutingSession的SQLAlchemy， mysql引擎使用带监控的连接池"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        apply_pool_options(app, info, options)
+
+
+def _replica_binds(app):
+    return list(app.config.get("SQLALCHEMY_REPLICA_BINDS") or [])
+
+
+# mysql的权限不足错误码， 没有REPLICATION CLIENT权限时SHOW SLAVE STATUS返回该错误
+_ER_SPECIFIC_ACCESS_DENIED = 1227
+
+# 已经记录过缺少权限警告的从库
+_no_privilege_warned = set()
+
+
+def _is_access_denied(error):
+    args = getattr(error.orig, "args", None)
+    return bool(args) and args[0] == _ER_SPECIFIC_ACCESS_DENIED
+
+
+def _check_replica(engine, bind=None):
+    """
+    检查从库： 能否执行查询， 复制线程是否正常， 复制延迟是否超过DB_REPLICA_MAX_LAG秒
+    账号没有REPLICATION CLIENT权限时复制延迟未知， 能执行查询即认为健康
+    :return: 是否健康
+    """
+
+    with engine.connect() as connection:
+        try:
+            row = connection.execute("SHOW SLAVE STATUS").first()
+        except DBAPIError as e:
+            if not _is_access_denied(e):
+                raise
+            if bind not in _no_privilege_warned:
+                _no_privilege_warned.add(bind)
+                logging.warning("replica %s: SHOW SLAVE STATUS denied, replication lag is unknown; "
+                                "grant REPLICATION CLIENT to the replica user" % bind)
+            connection.execute("SELECT 1")
+            return True
+    if row is None:
+        # 不是复制从库(例如开发环境直接指向主库)， 能执行查询即认为健康
+        return True
+    status = dict(row.items())
+    lag = status.get("Seconds_Behind_Master")
+    return status.get("Slave_IO_Running") == "Yes" and status.get("Slave_SQL_Running") == "Yes" \
+        and lag is not None and lag <= conf.DB_REPLICA_MAX_LAG
+
+
+def init_app(app, db):
+    """
+    为app注册读写分离
+    1. 请求开始时， 只读请求且用户不在主库粘滞期内时选择一个健康的从库
+    2. 请求结束时， 如果请求写入过数据库， 记录该用户的主库粘滞截止时间
+    3. 从库连接出错时暂停使用该从库
+    4. 启动从库健康检查线程
+    """
+
+    binds = _replica_binds(app)
+    if not binds:
+        return
+
+    @app.before_request
+    def choose_replica():
+        g.db_replica = None
+        if request.method not in ("GET", "HEAD"):
+            return
+        if session.get("db_primary_until", 0) > time.time():
+            return
+        healthy = replica_health.healthy(binds)
+        if healthy:
+            g.db_replica = random.choice(healthy)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get("db_written"):
+            session["db_primary_until"] = time.time() + conf.DB_REPLICA_STICKY_SECONDS
+        return response
+
+    with app.app_context():
+        for bind in binds:
+            engine = db.get_engine(app, bind=bind)
+
+            def handle_error(context, bind=bind):
+                if context.is_disconnect:
+                    replica_health.mark_down(bind)
+
+            event.listen(engine, "handle_error", handle_error)
+
+    start_health_checker(app, db, binds)
+
+
+def start_health_checker(app, db, binds, interval=None):
+    """启动从库健康检查的后台线程"""
+
+    interval = interval or conf.DB_REPLICA_CHECK_INTERVAL
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                for bind in binds:
+                    try:
+                        healthy = _check_replica(db.get_engine(app, bind=bind), bind)
+                    except Exception as e:
+                        logging.error(e)
+                        healthy = False
+                    if healthy:
+                        replica_health.mark_up(bind)
+                    else:
+                        replica_health.mark_down(bind, interval * 2)
+
+    thread = threading.Thread(target=run, name="replica-health-checker")
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+"""
+请求内的数据库操作范围
+会话默认从第一次查询一直占用连接到请求结束，接口中间调用七牛云、短信等外部接口时连接被白白占用。
+db_unit把一段数据库操作限定为一个短的单元，结束时提交或回滚并把连接还给连接池；
+outbound在调用外部接口之前归还连接，调用期间如果又取了连接，连接池会记录警告；
+会话中还有没有提交的修改时outbound直接报错，不会在归还连接时被静默回滚
+"""
+
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from FlaskFrame.frame import db
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    # 已经flush但还没有提交的修改不在new/dirty/deleted中， 需要单独记录
+    session.info["db_uncommitted"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    session.info.pop("db_uncommitted", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("db_uncommitted", None)
+
+
+def has_pending_changes(session=None):
+    """会话中是否有没有提交的修改"""
+
+    session = session or db.session
+    return bool(session.new or session.dirty or session.deleted or session.info.get("db_uncommitted"))
+
+
+@contextmanager
+def db_unit(commit=False):
+    """
+    一段短的数据库操作， 结束后归还连接
+    单元内查询出的对象在单元结束后仍可读取已加载的属性， 修改需要在新的单元中重新查询
+    :param commit: 是否在单元结束时提交
+    """
+
+    try:
+        yield db.session
+        if commit:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+@contextmanager
+def outbound(name):
+    """
+    调用外部接口， 调用之前归还数据库连接
+    需要保存的修改应该在调用之前提交， 或者放到调用之后的db_unit中
+    :param name: 外部接口的名字， 用于日志
+    :raise RuntimeError: 会话中有没有提交的修改
+    """
+
+    if has_pending_changes():
+        raise RuntimeError("uncommitted changes before calling %s" % name)
+
+    db.session.close()
+    if not has_app_context():
+        yield
+        return
+
+    g.db_outbound = name
+    try:
+        yield
+    finally:
+        g.db_outbound = None
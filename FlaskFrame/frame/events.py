@@ -0,0 +1,172 @@
+# -*- coding:utf-8 -*-
+"""
+订单/房屋写入回调
+在数据库事务提交成功之后，把订单的新增/状态变化、房屋的新增/修改通知给各个缓存、索引模块做增量更新，
+事务回滚时丢弃，保证缓存里不会出现没有落库的数据
+"""
+
+import logging
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from .models import House, Order
+
+
+# 订单变更回调函数列表
+_order_handlers = []
+
+# 房屋变更回调函数列表
+_house_handlers = []
+
+
+def on_order_change(func):
+    """
+    注册订单变更回调的装饰器
+    回调函数的参数为 (order_info, old_status)，新增订单时old_status为None
+    回调在事务提交之后执行，此时会话不能再执行SQL，回调里只能使用快照中的数据
+    :param func:
+    :return:
+    """
+
+    _order_handlers.append(func)
+    return func
+
+
+def on_house_change(func):
+    """
+    注册房屋变更回调的装饰器
+    回调函数的参数为 (house_info, created)，created表示是否为新增的房屋
+    :param func:
+    :return:
+    """
+
+    _house_handlers.append(func)
+    return func
+
+
+def _order_snapshot(order):
+    """提取订单的字段快照，提交之后对象可能已经过期，不能再直接访问属性"""
+
+    return {
+        "order_id": order.id,
+        "user_id": order.user_id,
+        "house_id": order.house_id,
+        "begin_date": order.begin_date,
+        "end_date": order.end_date,
+        "days": order.days,
+        "house_price": order.house_price,
+        "amount": order.amount,
+        "status": order.status,
+    }
+
+
+def old_value(state, name):
+    """修改前的字段值， 没有修改时为当前值， 只能在flush期间使用"""
+
+    history = state.attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(state.object, name)
+
+
+def _house_snapshot(house):
+    """提取房屋的字段快照， 包含区域和单价修改前的值"""
+
+    state = inspect(house)
+    return {
+        "house_id": house.id,
+        "user_id": house.user_id,
+        "area_id": house.area_id,
+        "title": house.title,
+        "address": house.address,
+        "price": house.price,
+        "capacity": house.capacity,
+        "order_count": house.order_count,
+        "index_image_url": house.index_image_url,
+        "create_time": house.create_time,
+        "old_area_id": old_value(state, "area_id"),
+        "old_price": old_value(state, "price"),
+    }
+
+
+def _stash(target, name, change):
+    """把变更暂存到会话上，等待事务提交"""
+
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault(name, []).append(change)
+
+
+def stash_created_houses(session, mappings):
+    """
+    bulk_insert_mappings不会触发mapper事件， 批量新增房屋后手动暂存快照， 提交之后同样通知各个回调
+    :param mappings: 已经插入的房屋字段字典， 需要包含id
+    """
+
+    changes = session.info.setdefault("house_changes", [])
+    for mapping in mappings:
+        changes.append(({
+            "house_id": mapping["id"],
+            "user_id": mapping["user_id"],
+            "area_id": mapping["area_id"],
+            "title": mapping["title"],
+            "address": mapping["address"],
+            "price": mapping["price"],
+            "capacity": mapping["capacity"],
+            "order_count": 0,
+            "index_image_url": mapping.get("index_image_url", ""),
+            "create_time": mapping["create_time"],
+            "old_area_id": mapping["area_id"],
+            "old_price": mapping["price"],
+        }, True))
+
+
+@event.listens_for(Order, "after_insert")
+def _after_order_insert(mapper, connection, target):
+    _stash(target, "order_changes", (_order_snapshot(target), None))
+
+
+@event.listens_for(Order, "after_update")
+def _after_order_update(mapper, connection, target):
+    # 只关心状态和日期的变化
+    state = inspect(target)
+    status_history = state.attrs.status.history
+    if not (status_history.has_changes()
+            or state.attrs.begin_date.history.has_changes()
+            or state.attrs.end_date.history.has_changes()):
+        return
+
+    old_status = status_history.deleted[0] if status_history.deleted else target.status
+    _stash(target, "order_changes", (_order_snapshot(target), old_status))
+
+
+@event.listens_for(House, "after_insert")
+def _after_house_insert(mapper, connection, target):
+    _stash(target, "house_changes", (_house_snapshot(target), True))
+
+
+@event.listens_for(House, "after_update")
+def _after_house_update(mapper, connection, target):
+    _stash(target, "house_changes", (_house_snapshot(target), False))
+
+
+def _dispatch(handlers, changes):
+    for change in changes:
+        for handler in handlers:
+            # 回调失败只记录日志，不影响已经提交的事务
+            try:
+                handler(*change)
+            except Exception as e:
+                logging.error(e)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    _dispatch(_house_handlers, session.info.pop("house_changes", None) or [])
+    _dispatch(_order_handlers, session.info.pop("order_changes", None) or [])
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("house_changes", None)
+    session.info.pop("order_changes", None)
@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*-
+"""
+房屋与订单的全量导出
+按主键分批读取(id > 上一批的最后编号 ORDER BY id LIMIT n)，每批只保留n行，逐行生成NDJSON或CSV文本，
+接口用生成器流式返回，命令行逐行写入文件，内存占用与表大小无关。
+每行都带有id，导出中断后用start_id=最后一行的id+1即可续传
+"""
+
+import csv
+import datetime
+import io
+import json
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import db
+from FlaskFrame.frame.models import House, Order
+
+
+# 可导出的表及其列， 不导出大字段
+EXPORT_TABLES = {
+    "houses": (House, ("id", "user_id", "area_id", "title", "price", "address", "room_count", "acreage",
+                       "unit", "capacity", "beds", "deposit", "min_days", "max_days", "order_count",
+                       "index_image_url", "facility_mask", "popularity", "create_time", "update_time")),
+    "orders": (Order, ("id", "user_id", "house_id", "begin_date", "end_date", "days", "house_price", "amount",
+                       "status", "create_time", "update_time")),
+}
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+
+def _format_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def iter_rows(table, start_id=None, end_id=None, batch_size=None):
+    """
+    按主键顺序分批读取记录
+    :param table: EXPORT_TABLES中的表名
+    :param start_id: 起始编号(包含)
+    :param end_id: 结束编号(包含)
+    :return: 生成器， 每项为列名到值的字典
+    """
+
+    model, columns = EXPORT_TABLES[table]
+    batch_size = batch_size or conf.EXPORT_BATCH_SIZE
+    entities = [getattr(model, column) for column in columns]
+
+    last_id = start_id - 1 if start_id else 0
+    while True:
+        query = db.session.query(*entities).filter(model.id > last_id)
+        if end_id:
+            query = query.filter(model.id <= end_id)
+        rows = query.order_by(model.id).limit(batch_size).all()
+        # 每批结束后释放连接， 长时间的导出不会一直占用连接和事务快照
+        db.session.remove()
+        if not rows:
+            return
+
+        for row in rows:
+            yield dict(zip(columns, [_format_value(value) for value in row]))
+        last_id = rows[-1][0]
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_csv(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return value
+
+    writer.writerow(columns)
+    yield flush()
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+        yield flush()
+
+
+def _format_lines(table, fmt, rows, header=True):
+    if fmt == "csv":
+        lines = iter_csv(rows, EXPORT_TABLES[table][1])
+        if not header:
+            next(lines)
+        return lines
+    return iter_ndjson(rows)
+
+
+def iter_export(table, fmt, start_id=None, end_id=None):
+    """
+    生成导出文本
+    :param fmt: ndjson 或 csv， csv的第一行为列名
+    :return: 生成器， 每项为一行文本
+    """
+
+    return _format_lines(table, fmt, iter_rows(table, start_id, end_id))
+
+
+def export_to_file(table, fmt, f, start_id=None, end_id=None, header=True):
+    """
+    导出到文件
+    :param header: csv是否写入列名， 续传时不需要
+    :return: (导出的行数， 最后一行的编号)
+    """
+
+    state = {"count": 0, "last_id": None}
+
+    def track(rows):
+        for row in rows:
+            state["count"] += 1
+            state["last_id"] = row["id"]
+            yield row
+
+    for line in _format_lines(table, fmt, track(iter_rows(table, start_id, end_id)), header):
+        f.write(line)
+    return state["count"], state["last_id"]
@@ -0,0 +1,110 @@
+# -*- coding:utf-8 -*-
+"""
+房屋搜索的聚合数据
+各区域的房屋数和单价直方图预先计算好保存在redis的hash house_facets中:
+    area_<area_id> -> 区域房屋数， price_<桶序号> -> 单价落在该桶的房屋数， total -> 房屋总数
+全量计算用numpy向量化分桶，新增或修改房屋时只做HINCRBY，读取时一次HGETALL
+"""
+
+import numpy as np
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store
+from FlaskFrame.frame.events import on_house_change
+from FlaskFrame.frame.models import House
+
+
+FACETS_KEY = "house_facets"
+
+
+def _price_edges():
+    """单价分桶的边界， 单位：分"""
+
+    return np.array(conf.HOUSE_FACET_PRICE_EDGES, dtype=np.int64) * 100
+
+
+def price_bucket(price):
+    """单价所在的桶序号， 第i个桶为[edges[i], edges[i+1])， 最后一个桶没有上限"""
+
+    return int(np.searchsorted(_price_edges(), price or 0, side="right")) - 1
+
+
+def rebuild_facets():
+    """
+    从mysql全量计算聚合数据
+    :return: 房屋总数
+    """
+
+    rows = House.query.with_entities(House.area_id, House.price).all()
+    area_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    prices = np.fromiter((row[1] or 0 for row in rows), dtype=np.int64, count=len(rows))
+
+    mapping = {"total": len(rows)}
+
+    area_counts = np.bincount(area_ids) if len(rows) else np.zeros(0, dtype=np.int64)
+    for area_id in np.flatnonzero(area_counts):
+        mapping["area_%d" % area_id] = int(area_counts[area_id])
+
+    edges = _price_edges()
+    buckets = np.searchsorted(edges, prices, side="right") - 1
+    bucket_counts = np.bincount(buckets, minlength=len(edges))
+    for bucket, count in enumerate(bucket_counts):
+        mapping["price_%d" % bucket] = int(count)
+
+    pip = redis_store.pipeline()
+    pip.delete(FACETS_KEY)
+    pip.hmset(FACETS_KEY, mapping)
+    pip.execute()
+    return len(rows)
+
+
+def get_facets():
+    """
+    获取聚合数据， 不存在时全量计算
+    :return: {"total": 房屋总数, "areas": [...], "prices": [...]}
+    """
+
+    cached = redis_store.hgetall(FACETS_KEY)
+    if not cached:
+        rebuild_facets()
+        cached = redis_store.hgetall(FACETS_KEY)
+
+    counts = {}
+    for field, value in cached.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        counts[field] = int(value)
+
+    areas = []
+    for field, count in counts.items():
+        if field.startswith("area_") and count > 0:
+            areas.append({"aid": int(field[len("area_"):]), "count": count})
+    areas.sort(key=lambda item: item["aid"])
+
+    edges = conf.HOUSE_FACET_PRICE_EDGES
+    prices = []
+    for bucket, low in enumerate(edges):
+        prices.append({
+            "min": low,
+            "max": edges[bucket + 1] if bucket + 1 < len(edges) else None,
+            "count": counts.get("price_%d" % bucket, 0),
+        })
+
+    return {"total": counts.get("total", 0), "areas": areas, "prices": prices}
+
+
+@on_house_change
+def _count_house(house_info, created):
+    """新增房屋时累加， 区域或单价修改时从原来的区域、桶转移"""
+
+    if not redis_store.exists(FACETS_KEY):
+        return
+
+    pip = redis_store.pipeline()
+    if created:
+        pip.hincrby(FACETS_KEY, "total", 1)
+    else:
+        pip.hincrby(FACETS_KEY, "area_%s" % house_info["old_area_id"], -1)
+        pip.hincrby(FACETS_KEY, "price_%d" % price_bucket(house_info["old_price"]), -1)
+    pip.hincrby(FACETS_KEY, "area_%s" % house_info["area_id"], 1)
+    pip.hincrby(FACETS_KEY, "price_%d" % price_bucket(house_info["price"]), 1)
+    pip.execute()
@@ -0,0 +1,128 @@
+# -*- coding:utf-8 -*-
+"""
+房屋基本信息缓存
+每个房屋的to_basic_dict()结果单独缓存为house_basic_<house_id>，列表类接口拿到房屋编号后用MGET一次取回，
+只有缓存缺失的房屋才查询mysql。
+房东的房源列表按页缓存在hash user_houses_<user_id>中，房东新增或修改房屋时整体删除
+"""
+
+import json
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, db, redis_scripts
+from FlaskFrame.frame.events import on_house_change
+from FlaskFrame.frame.models import Area, House, User
+
+
+def _basic_key(house_id):
+    return "house_basic_%s" % house_id
+
+
+def get_basic_dicts(house_ids):
+    """
+    按house_ids的顺序获取房屋基本信息， 不存在的房屋会被跳过
+    :param house_ids: 房屋编号列表
+    :return: [house_dict, ...]
+    """
+
+    house_ids = [int(house_id) for house_id in house_ids]
+    if not house_ids:
+        return []
+
+    cached = redis_store.mget([_basic_key(house_id) for house_id in house_ids])
+
+    houses = {}
+    missing = []
+    for house_id, value in zip(house_ids, cached):
+        if value:
+            houses[house_id] = json.loads(value)
+        else:
+            missing.append(house_id)
+
+    if missing:
+        pip = redis_store.pipeline(transaction=False)
+        for house in House.query.filter(House.id.in_(missing)).all():
+            house_dict = house.to_basic_dict()
+            houses[house.id] = house_dict
+            pip.setex(_basic_key(house.id), conf.HOUSE_BASIC_REDIS_EXPIRES, json.dumps(house_dict))
+        pip.execute()
+
+    return [houses[house_id] for house_id in house_ids if house_id in houses]
+
+
+def invalidate_basic(*house_ids):
+    """房屋信息或订单数修改后删除基本信息缓存"""
+
+    if house_ids:
+        redis_store.delete(*[_basic_key(house_id) for house_id in house_ids])
+
+
+def _user_houses_key(user_id):
+    return "user_houses_%s" % user_id
+
+
+def _lean_basic_dict(row):
+    """由投影查询的一行构造与to_basic_dict()相同格式的数据"""
+
+    house_id, title, price, area_name, index_image_url, room_count, order_count, address, \
+        avatar_url, create_time = row
+    return {
+        "house_id": house_id,
+        "title": title,
+        "price": price,
+        "area_name": area_name,
+        "img_url": conf.QINIU_DOMIN_PREFIX + index_image_url if index_image_url else "",
+        "room_count": room_count,
+        "order_count": order_count,
+        "address": address,
+        "user_avatar": conf.QINIU_DOMIN_PREFIX + avatar_url if avatar_url else "",
+        "ctime": create_time.strftime("%Y-%m-%d")
+    }
+
+
+def get_user_houses_page(user_id, page, per_page=None):
+    """
+    分页获取房东发布的房源： 缓存-磁盘-缓存
+    只查询需要的列， 区域名称和房东头像通过连接一次取回
+    :return: {"houses": [...], "total_page": 总页数, "current_page": 页码}
+    """
+
+    per_page = per_page or conf.USER_HOUSES_PAGE_CAPACITY
+    key = _user_houses_key(user_id)
+
+    cached = redis_store.hget(key, page)
+    if cached:
+        return json.loads(cached)
+
+    query = db.session.query(House.id, House.title, House.price, Area.name, House.index_image_url,
+                             House.room_count, House.order_count, House.address, User.avatar_url,
+                             House.create_time) \
+        .join(Area, Area.id == House.area_id) \
+        .join(User, User.id == House.user_id) \
+        .filter(House.user_id == user_id)
+
+    total = query.order_by(None).count()
+    rows = query.order_by(House.create_time.desc(), House.id.desc()) \
+        .offset((page - 1) * per_page).limit(per_page).all()
+
+    data = {
+        "houses": [_lean_basic_dict(row) for row in rows],
+        "total_page": (total + per_page - 1) // per_page,
+        "current_page": page
+    }
+
+    redis_scripts.hset_expire(key, page, json.dumps(data), conf.USER_HOUSES_REDIS_EXPIRES)
+    return data
+
+
+def invalidate_user_houses(user_id):
+    """房东信息(例如头像)修改后删除房源列表缓存"""
+
+    redis_store.delete(_user_houses_key(user_id))
+
+
+@on_house_change
+def _invalidate_changed_house(house_info, created):
+    """房屋新增或修改后删除该房屋的基本信息缓存以及房东的房源列表缓存"""
+
+    redis_store.delete(_basic_key(house_info["house_id"]), _user_houses_key(house_info["user_id"]))
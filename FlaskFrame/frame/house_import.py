@@ -0,0 +1,236 @@
+# -*- coding:utf-8 -*-
+"""
+房屋批量导入
+逐行读取CSV或NDJSON，每HOUSE_IMPORT_CHUNK_SIZE行为一批：先在内存中校验整批数据(区域和设施从进程内缓存的映射中查找，
+不再逐行查询)，再用bulk_insert_mappings在一个事务中写入房屋、房屋设施和房屋图片，一批只提交一次。
+房屋用一条多行INSERT写入，新编号由LAST_INSERT_ID()和本批的创建时间查询得到，不逐行回填。
+校验失败的行返回行号和原因；一批写入失败时逐行重试，只有真正失败的行返回原因，不影响其他行
+"""
+
+import csv
+import datetime
+import json
+import time
+
+from sqlalchemy import func, select
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import db
+from FlaskFrame.frame.events import stash_created_houses
+from FlaskFrame.frame.models import Area, Facility, House, HouseImage, house_facility
+
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+# 必填的字段， 与save_house_info的参数一致
+REQUIRED_FIELDS = ("title", "price", "area_id", "address", "room_count", "acreage", "unit", "capacity", "beds",
+                   "deposit", "min_days", "max_days")
+
+INT_FIELDS = ("area_id", "room_count", "acreage", "capacity", "min_days", "max_days")
+
+# 有长度限制的文本字段， 长度取自表结构
+TEXT_FIELDS = ("title", "address", "unit", "beds")
+
+# 区域和设施的进程内缓存 (过期时间, 区域编号集合, 设施名称/编号到设施编号的映射)
+_lookup_cache = [0, None, None]
+
+
+def _lookups():
+    now = time.time()
+    if _lookup_cache[0] < now:
+        area_ids = set(area_id for area_id, in Area.query.with_entities(Area.id))
+        facilities = {}
+        for facility_id, name in Facility.query.with_entities(Facility.id, Facility.name):
+            facilities[str(facility_id)] = facility_id
+            facilities[name] = facility_id
+        _lookup_cache[:] = [now + conf.HOUSE_IMPORT_LOOKUP_SECONDS, area_ids, facilities]
+    return _lookup_cache[1], _lookup_cache[2]
+
+
+def _split(value):
+    """CSV中的多个值用|分隔， NDJSON中可以直接使用列表"""
+
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value or "").split("|") if item.strip()]
+
+
+def parse_rows(f, fmt):
+    """
+    逐行解析导入文件
+    :param f: 文本文件对象或逐行的字符串迭代器
+    :return: 生成器， 每项为 (行号, 字段字典或None, 解析错误或None)
+    """
+
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+            assert isinstance(row, dict)
+        except Exception:
+            yield line_no, None, "不是有效的json对象"
+            continue
+        yield line_no, row, None
+
+
+def validate_row(row, user_id, area_ids, facilities):
+    """
+    校验一行数据
+    :return: (房屋字段字典, 设施编号列表, 图片路径列表)
+    :raise ValueError: 校验失败的原因
+    """
+
+    if not all(row.get(field) not in (None, "") for field in REQUIRED_FIELDS):
+        raise ValueError("参数不完整")
+
+    try:
+        mapping = dict((field, int(row[field])) for field in INT_FIELDS)
+        # 金额单位： 元--》分
+        mapping["price"] = int(float(row["price"]) * 100)
+        mapping["deposit"] = int(float(row["deposit"]) * 100)
+    except (TypeError, ValueError):
+        raise ValueError("数值格式错误")
+
+    if mapping["area_id"] not in area_ids:
+        raise ValueError("区域不存在")
+
+    facility_ids = []
+    for item in _split(row.get("facility")):
+        if item not in facilities:
+            raise ValueError("设施不存在: %s" % item)
+        if not 0 < facilities[item] <= conf.HOUSE_FACILITY_MAX_ID:
+            raise ValueError("设施编号超出范围: %s" % item)
+        facility_ids.append(facilities[item])
+    facility_ids = sorted(set(facility_ids))
+
+    images = _split(row.get("images"))
+
+    for field in TEXT_FIELDS:
+        mapping[field] = str(row[field])
+        length = House.__table__.c[field].type.length
+        if len(mapping[field]) > length:
+            raise ValueError("%s超过%s个字符" % (field, length))
+
+    now = datetime.datetime.now()
+    mapping.update({
+        "user_id": user_id,
+        "order_count": 0,
+        "facility_mask": House.make_facility_mask(facility_ids),
+        "popularity": 0,
+        "index_image_url": images[0] if images else "",
+        "create_time": now,
+        "update_time": now,
+    })
+    return mapping, facility_ids, images
+
+
+def _insert_houses(mappings):
+    """
+    一条多行INSERT写入房屋并回填编号
+    LAST_INSERT_ID()是本连接这条语句插入的第一行的编号， 同一条语句的行编号递增，
+    再用房屋主人和本批统一的创建时间限定为本批的行
+    """
+
+    db.session.bulk_insert_mappings(House, mappings)
+    first_id = db.session.execute(select([func.last_insert_id()])).scalar()
+    house_ids = [house_id for house_id, in db.session.query(House.id).filter(
+        House.id >= first_id, House.user_id == mappings[0]["user_id"],
+        House.create_time == mappings[0]["create_time"]).order_by(House.id).limit(len(mappings) + 1)]
+    if len(house_ids) != len(mappings):
+        raise RuntimeError("无法确定新房屋的编号")
+    for mapping, house_id in zip(mappings, house_ids):
+        mapping["id"] = house_id
+
+
+def _insert_chunk(valid):
+    """
+    在一个事务中写入一批已校验的房屋
+    :param valid: [(行号, 房屋字段字典, 设施编号列表, 图片路径列表), ...]
+    :return: 新房屋编号列表
+    """
+
+    # 本批使用同一个创建时间， 去掉mysql不保存的微秒
+    now = datetime.datetime.now().replace(microsecond=0)
+    mappings = [dict(item[1], create_time=now, update_time=now) for item in valid]
+    try:
+        _insert_houses(mappings)
+
+        facility_rows = [{"house_id": mapping["id"], "facility_id": facility_id}
+                         for mapping, (_, _, facility_ids, _) in zip(mappings, valid) for facility_id in facility_ids]
+        if facility_rows:
+            db.session.execute(house_facility.insert(), facility_rows)
+
+        image_rows = [{"house_id": mapping["id"], "url": url, "create_time": now, "update_time": now}
+                      for mapping, (_, _, _, images) in zip(mappings, valid) for url in images]
+        if image_rows:
+            db.session.bulk_insert_mappings(HouseImage, image_rows)
+
+        stash_created_houses(db.session, mappings)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return [mapping["id"] for mapping in mappings]
+
+
+def import_houses(user_id, rows, chunk_size=None, max_errors=None):
+    """
+    批量导入房屋
+    :param user_id: 房屋主人的用户编号
+    :param rows: parse_rows的结果
+    :return: {"imported": 导入的房屋数, "failed": 失败的行数, "house_ids": [...], "errors": [{"line", "errmsg"}, ...]}
+    """
+
+    chunk_size = chunk_size or conf.HOUSE_IMPORT_CHUNK_SIZE
+    max_errors = max_errors or conf.HOUSE_IMPORT_MAX_ERRORS
+    result = {"imported": 0, "failed": 0, "house_ids": [], "errors": []}
+
+    def fail(line_no, errmsg):
+        result["failed"] += 1
+        if len(result["errors"]) < max_errors:
+            result["errors"].append({"line": line_no, "errmsg": errmsg})
+
+    def flush(chunk):
+        area_ids, facilities = _lookups()
+        valid = []
+        for line_no, row in chunk:
+            try:
+                valid.append((line_no,) + validate_row(row, user_id, area_ids, facilities))
+            except ValueError as e:
+                fail(line_no, str(e))
+        if not valid:
+            return
+
+        try:
+            house_ids = _insert_chunk(valid)
+        except Exception:
+            # 整批失败时逐行重试， 找出真正失败的行
+            house_ids = []
+            for item in valid:
+                try:
+                    house_ids.extend(_insert_chunk([item]))
+                except Exception as e:
+                    fail(item[0], "保存失败: %s" % e)
+        result["imported"] += len(house_ids)
+        result["house_ids"].extend(house_ids)
+
+    chunk = []
+    for line_no, row, error in rows:
+        if error:
+            fail(line_no, error)
+            continue
+        chunk.append((line_no, row))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return result
@@ -0,0 +1,262 @@
+# -*- coding:utf-8 -*-
+"""
+房屋列字段快照
+定时把ih_house_info中搜索用到的列导出为numpy数组文件，每一列一个.npy文件，放在同一个快照目录下，
+目录名带有生成时间，生成完成后把软链接current原子替换到新目录。
+生成时为每种排序预先计算好行的排列，查询时按排列顺序过滤即得到有序结果，不需要每次排序。
+各个worker进程以mmap方式只读加载，共享操作系统的页缓存，过滤都在进程内向量化完成。
+快照目录在各台主机本地，每台主机各自生成，还没有快照时列表改用mysql查询
+"""
+
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, db
+from FlaskFrame.frame.models import House, house_facility
+
+
+COLUMNS = ("id", "area_id", "price", "order_count", "popularity", "create_time", "capacity", "facilities")
+
+# 列表排序参数sk对应的列以及是否倒序
+SORT_KEYS = {
+    "booking": ("popularity", True),
+    "price-inc": ("price", False),
+    "price-des": ("price", True),
+    "new": ("create_time", True),
+}
+
+# 生成快照的锁，同一台主机上的多个进程只有一个生成，快照目录在本机，每台主机各自持有锁
+BUILD_LOCK_KEY = "house_snapshot_build_lock_%s"
+
+_CURRENT = "current"
+
+
+def facility_bit(facility_id):
+    """设施编号对应的位，设施编号从1开始，最多64个"""
+
+    return np.uint64(1) << np.uint64(facility_id - 1)
+
+
+def facility_mask(facility_ids):
+    """多个设施编号合并为位掩码"""
+
+    mask = np.uint64(0)
+    for facility_id in facility_ids:
+        mask |= facility_bit(int(facility_id))
+    return mask
+
+
+def _order_file(sort_key):
+    return "order_%s.npy" % sort_key
+
+
+def sort_order(columns, sort_key):
+    """按排序参数排列的行号"""
+
+    column, desc = SORT_KEYS[sort_key]
+    values = columns[column]
+    if sort_key == "booking":
+        # 热度相同时按成交订单数， 与mysql的排序一致
+        return np.lexsort((-columns["order_count"], -values))
+    return np.argsort(-values if desc else values, kind="stable")
+
+
+def build_snapshot(snapshot_dir=None):
+    """
+    从mysql导出房屋列快照
+    1. 查询房屋的列数据
+    2. 查询房屋设施， 合并为每个房屋的设施位掩码
+    3. 计算每种排序的行排列
+    4. 写入新的快照目录
+    5. 原子替换current软链接， 删除旧的快照目录
+    :return: 快照中的房屋数
+    """
+
+    snapshot_dir = snapshot_dir or conf.HOUSE_SNAPSHOT_DIR
+    if not os.path.exists(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    rows = House.query.with_entities(House.id, House.area_id, House.price, House.order_count,
+                                      House.create_time, House.capacity, House.popularity).order_by(House.id).all()
+    count = len(rows)
+
+    columns = {
+        "id": np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+        "area_id": np.fromiter((row[1] for row in rows), dtype=np.int32, count=count),
+        "price": np.fromiter((row[2] or 0 for row in rows), dtype=np.int64, count=count),
+        "order_count": np.fromiter((row[3] or 0 for row in rows), dtype=np.int64, count=count),
+        "create_time": np.fromiter((time.mktime(row[4].timetuple()) if row[4] else 0 for row in rows),
+                                   dtype=np.float64, count=count),
+        "capacity": np.fromiter((row[5] or 0 for row in rows), dtype=np.int32, count=count),
+        "popularity": np.fromiter((row[6] or 0 for row in rows), dtype=np.float64, count=count),
+        "facilities": np.zeros(count, dtype=np.uint64),
+    }
+
+    # 房屋编号有序， 用二分查找定位设施所属的行
+    links = db.session.execute(select([house_facility.c.house_id, house_facility.c.facility_id])).fetchall()
+    if links:
+        link_houses = np.array([link[0] for link in links], dtype=np.int64)
+        link_facilities = np.array([link[1] for link in links], dtype=np.uint64)
+        valid = (link_facilities >= 1) & (link_facilities <= 64)
+        if not valid.all():
+            logging.warning("house snapshot skips %s facilities with id > 64" % int((~valid).sum()))
+        link_houses, link_facilities = link_houses[valid], link_facilities[valid]
+        positions = np.searchsorted(columns["id"], link_houses)
+        found = (positions < count) & (columns["id"][np.minimum(positions, max(count - 1, 0))] == link_houses)
+        bits = np.left_shift(np.uint64(1), link_facilities[found] - np.uint64(1))
+        np.bitwise_or.at(columns["facilities"], positions[found], bits)
+
+    # 写入新的快照目录
+    name = "snapshot_%d" % int(time.time() * 1000)
+    path = os.path.join(snapshot_dir, name)
+    os.makedirs(path)
+    for column in COLUMNS:
+        np.save(os.path.join(path, column + ".npy"), columns[column])
+    for sort_key in SORT_KEYS:
+        np.save(os.path.join(path, _order_file(sort_key)), sort_order(columns, sort_key))
+
+    # 原子替换软链接
+    current = os.path.join(snapshot_dir, _CURRENT)
+    tmp_link = current + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(name, tmp_link)
+    os.replace(tmp_link, current)
+
+    # 删除旧快照， 已经mmap的进程在重新加载之前仍然可以访问已删除的文件
+    for old in os.listdir(snapshot_dir):
+        if old.startswith("snapshot_") and old != name:
+            shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+
+    return count
+
+
+class HouseSnapshot(object):
+    """以mmap方式加载的房屋列快照"""
+
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir or conf.HOUSE_SNAPSHOT_DIR
+        self.name = None
+        self.columns = None
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """
+        软链接指向的快照变化时重新加载， 最多每HOUSE_SNAPSHOT_CHECK_SECONDS检查一次
+        :return: 列数据， 本机还没有生成快照时返回None
+        """
+
+        now = time.time()
+        if self.columns is not None and now - self.checked_at < conf.HOUSE_SNAPSHOT_CHECK_SECONDS:
+            return self.columns
+
+        with self._lock:
+            self.checked_at = now
+            try:
+                name = os.readlink(os.path.join(self.snapshot_dir, _CURRENT))
+            except OSError:
+                return self.columns
+            if name != self.name:
+                path = os.path.join(self.snapshot_dir, name)
+                columns = {column: np.load(os.path.join(path, column + ".npy"), mmap_mode="r")
+                           for column in COLUMNS}
+                for sort_key in SORT_KEYS:
+                    order_path = os.path.join(path, _order_file(sort_key))
+                    columns[_order_file(sort_key)] = np.load(order_path, mmap_mode="r") \
+                        if os.path.exists(order_path) else sort_order(columns, sort_key)
+                self.columns = columns
+                self.name = name
+        return self.columns
+
+    def search(self, area_id=None, sort_key=None, page=1, per_page=None, exclude_ids=None, facility_ids=None,
+               price_min=None, price_max=None, guests=None):
+        """
+        过滤、排序、分页
+        :param area_id: 区域编号， 为空表示全部区域
+        :param sort_key: 排序参数sk
+        :param page: 页码， 从1开始
+        :param exclude_ids: 需要排除的房屋编号， 例如日期冲突的房屋
+        :param facility_ids: 必须具备的设施编号
+        :param price_min: 最低单价， 单位：分
+        :param price_max: 最高单价， 单位：分
+        :param guests: 入住人数， 房屋容纳人数不能少于该值
+        :return: (房屋编号列表， 总页数)， 还没有快照时返回None
+        """
+
+        per_page = per_page or conf.HOUSE_LIST_PAGE_CAPACITY
+        columns = self._load()
+        if columns is None:
+            return None
+
+        mask = np.ones(len(columns["id"]), dtype=bool)
+        if area_id:
+            mask &= columns["area_id"] == int(area_id)
+        if price_min is not None:
+            mask &= columns["price"] >= price_min
+        if price_max is not None:
+            mask &= columns["price"] <= price_max
+        if guests:
+            mask &= columns["capacity"] >= guests
+        if facility_ids:
+            required = facility_mask(facility_ids)
+            mask &= (columns["facilities"] & required) == required
+        if exclude_ids:
+            mask &= ~np.isin(columns["id"], np.fromiter(exclude_ids, dtype=np.int64))
+
+        # 按预先计算的排列取出满足条件的行， 结果已经有序
+        order = columns[_order_file(sort_key if sort_key in SORT_KEYS else "new")]
+        rows = order[mask[order]]
+
+        total_page = (len(rows) + per_page - 1) // per_page
+        start = (page - 1) * per_page
+        page_rows = rows[start:start + per_page]
+        return [int(house_id) for house_id in columns["id"][page_rows]], total_page
+
+
+snapshot = HouseSnapshot()
+
+
+def enabled():
+    """是否使用快照查询房屋列表"""
+
+    return conf.HOUSE_SEARCH_BACKEND == "snapshot"
+
+
+def rebuild_once():
+    """获取锁之后生成一次快照"""
+
+    # 锁在有效期内不释放， 每个周期每台主机只由一个进程生成
+    if not redis_store.set(BUILD_LOCK_KEY % socket.gethostname(), 1, nx=True, ex=conf.HOUSE_SNAPSHOT_INTERVAL):
+        return 0
+    return build_snapshot()
+
+
+def start_rebuilder(app, interval=None):
+    """启动定时生成快照的后台线程"""
+
+    interval = interval or conf.HOUSE_SNAPSHOT_INTERVAL
+
+    def run():
+        while True:
+            with app.app_context():
+                try:
+                    rebuild_once()
+                except Exception as e:
+                    logging.error(e)
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="house-snapshot-rebuilder")
+    thread.daemon = True
+    thread.start()
+    return thread
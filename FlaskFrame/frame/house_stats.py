@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+"""
+房东的入住率与收入统计
+订单进入/离开已支付类状态、或者已支付订单的日期变化时，把订单覆盖的每一天累加到ih_house_daily_stat，
+汇总在订单写入的同一个事务中完成，订单回滚时汇总一起回滚。
+统计接口只读汇总表，不再对ih_order_info做临时聚合。历史订单通过manage.py backfill_house_stats补齐
+"""
+
+import datetime
+
+from sqlalchemy import event, inspect, select, text
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import db
+from FlaskFrame.frame.events import old_value
+from FlaskFrame.frame.models import House, HouseDailyStat, Order
+
+
+# 影响汇总的订单字段
+_ROLLUP_FIELDS = ("status", "house_id", "begin_date", "days", "house_price")
+
+_UPSERT = text(
+    "INSERT INTO ih_house_daily_stat (house_id, stat_date, occupied, revenue, create_time, update_time) "
+    "VALUES (:house_id, :stat_date, :occupied, :revenue, :now, :now) "
+    "ON DUPLICATE KEY UPDATE occupied = occupied + VALUES(occupied), revenue = revenue + VALUES(revenue), "
+    "update_time = VALUES(update_time)")
+
+
+def order_days(house_id, begin_date, days, house_price, sign=1):
+    """
+    订单覆盖的每一天的汇总行
+    :return: [{"house_id", "stat_date", "occupied", "revenue"}, ...]
+    """
+
+    begin = begin_date.date() if isinstance(begin_date, datetime.datetime) else begin_date
+    return [{
+        "house_id": house_id,
+        "stat_date": begin + datetime.timedelta(days=i),
+        "occupied": sign,
+        "revenue": sign * (house_price or 0),
+    } for i in range(days or 0)]
+
+
+def _upsert(connection, rows):
+    now = datetime.datetime.now()
+    for i in range(0, len(rows), conf.HOUSE_STATS_BATCH_SIZE):
+        batch = [dict(row, now=now) for row in rows[i:i + conf.HOUSE_STATS_BATCH_SIZE]]
+        connection.execute(_UPSERT, batch)
+
+
+def _merge(rows):
+    """合并同一房屋同一天的行， 日期区间移动时重叠的日期抵消"""
+
+    totals = {}
+    for row in rows:
+        key = (row["house_id"], row["stat_date"])
+        occupied, revenue = totals.get(key, (0, 0))
+        totals[key] = (occupied + row["occupied"], revenue + row["revenue"])
+    return [{"house_id": key[0], "stat_date": key[1], "occupied": value[0], "revenue": value[1]}
+            for key, value in totals.items() if value != (0, 0)]
+
+
+def backfill():
+    """
+    根据历史订单重新生成汇总表， 按房屋编号分批， 每批HOUSE_STATS_BACKFILL_HOUSES个房屋在一个短事务中完成，
+    不会长时间锁住或清空整个汇总表， 可以在线执行
+    1. 按主键分页读取一批房屋编号
+    2. 用加锁读读取这批房屋已经提交的订单， 这批房屋的订单写入等待本事务提交，
+       与订单事务一样先锁订单再写汇总， 不会互相死锁
+    3. 删除这批房屋的汇总行， 在内存中按(房屋, 日期)累加后写入
+    :return: 处理的订单数
+    """
+
+    houses = House.__table__
+    orders = Order.__table__
+    stats = HouseDailyStat.__table__
+
+    count = 0
+    last_id = 0
+    while True:
+        house_ids = [house_id for house_id, in db.engine.execute(
+            select([houses.c.id]).where(houses.c.id > last_id).order_by(houses.c.id)
+            .limit(conf.HOUSE_STATS_BACKFILL_HOUSES)).fetchall()]
+        if not house_ids:
+            return count
+        last_id = house_ids[-1]
+
+        query = select([orders.c.house_id, orders.c.begin_date, orders.c.days, orders.c.house_price]) \
+            .where(orders.c.house_id.in_(house_ids)) \
+            .where(orders.c.status.in_(conf.HOUSE_STATS_ORDER_STATUS)) \
+            .with_for_update(read=True)
+        with db.engine.begin() as connection:
+            rows = []
+            for house_id, begin_date, days, house_price in connection.execute(query).fetchall():
+                rows.extend(order_days(house_id, begin_date, days, house_price))
+                count += 1
+            connection.execute(stats.delete().where(stats.c.house_id.in_(house_ids)))
+            _upsert(connection, _merge(rows))
+
+
+def _rollup_rows(order, old=None):
+    """
+    订单变化对应的汇总行， 修改前计入统计的扣减， 修改后计入统计的累加
+    :param old: 修改前的字段值， 新增订单时为None
+    """
+
+    rows = []
+    if old and old["status"] in conf.HOUSE_STATS_ORDER_STATUS:
+        rows.extend(order_days(old["house_id"], old["begin_date"], old["days"], old["house_price"], -1))
+    if order.status in conf.HOUSE_STATS_ORDER_STATUS:
+        rows.extend(order_days(order.house_id, order.begin_date, order.days, order.house_price, 1))
+    return _merge(rows)
+
+
+@event.listens_for(Order, "after_insert")
+def _rollup_inserted_order(mapper, connection, target):
+    """使用flush的连接， 汇总和订单在同一个事务中"""
+
+    _upsert(connection, _rollup_rows(target))
+
+
+@event.listens_for(Order, "after_update")
+def _rollup_updated_order(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in _ROLLUP_FIELDS):
+        return
+
+    old = dict((name, old_value(state, name)) for name in _ROLLUP_FIELDS)
+    _upsert(connection, _rollup_rows(target, old))
@@ -0,0 +1,216 @@
+# -*- coding:utf-8 -*-
+"""
+房屋标题、地址的关键字索引
+使用本地SQLite FTS5文件作为倒排索引，所有worker进程共享同一个文件。
+中文没有空格分词，入库和查询前先把文本切分为二元组(北京朝阳 -> 北京 京朝 朝阳)，英文和数字按单词切分，
+再用空格连接交给FTS5，排序使用bm25，标题的权重高于地址。
+入库时每段中文的最后一个字额外保留为单字，查询单个汉字时用前缀匹配，可以命中所有包含该字的文本。
+索引文件在各台主机本地，房屋修改回调只更新提交修改的那台主机，其他主机在查询时
+每HOUSE_KEYWORD_SYNC_SECONDS按更新时间从mysql补齐修改过的房屋；新主机需要先运行manage.py rebuild_keyword_index
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame.events import on_house_change
+from FlaskFrame.frame.models import House
+
+
+# 中文字符的连续片段， 以及英文/数字单词
+_TOKEN_RE = re.compile(u"([一-鿿]+)|([0-9a-z]+)")
+
+_local = threading.local()
+
+_TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def tokenize(text, for_index=False):
+    """
+    切分文本
+    :param for_index: 入库时每段中文的最后一个字额外保留为单字， 单字查询的前缀匹配才能命中段尾的字
+    :return: 词列表， 中文为二元组， 单个汉字保留为一个词
+    """
+
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall((text or "").lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            if for_index:
+                tokens.append(cjk[-1])
+    return tokens
+
+
+def _match_query(tokens):
+    """
+    FTS5查询语句， 所有的词都需要命中
+    单个汉字不是完整的二元组， 使用前缀匹配： 京* 命中 京朝 以及段尾的 京
+    """
+
+    terms = []
+    for token in tokens:
+        if len(token) == 1 and _TOKEN_RE.match(token).group(1):
+            terms.append('"%s"*' % token)
+        else:
+            terms.append('"%s"' % token)
+    return " ".join(terms)
+
+
+def _connection():
+    """每个线程一个SQLite连接"""
+
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        path = conf.HOUSE_KEYWORD_INDEX_PATH
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS house_fts USING fts5(title, address)")
+        conn.execute("CREATE TABLE IF NOT EXISTS house_fts_meta (name TEXT PRIMARY KEY, value TEXT)")
+        _local.conn = conn
+        _local.checked_at = 0
+    return conn
+
+
+def _write(conn, house_id, title, address):
+    conn.execute("DELETE FROM house_fts WHERE rowid = ?", (house_id,))
+    conn.execute("INSERT INTO house_fts(rowid, title, address) VALUES (?, ?, ?)",
+                 (house_id, " ".join(tokenize(title, True)), " ".join(tokenize(address, True))))
+
+
+def _set_synced(conn, synced_at):
+    conn.execute("INSERT OR REPLACE INTO house_fts_meta(name, value) VALUES ('synced_at', ?)",
+                 (synced_at.strftime(_TIME_FMT),))
+
+
+def _get_synced(conn):
+    row = conn.execute("SELECT value FROM house_fts_meta WHERE name = 'synced_at'").fetchone()
+    return datetime.datetime.strptime(row[0], _TIME_FMT) if row else None
+
+
+def index_house(house_id, title, address):
+    """新增或更新房屋的索引"""
+
+    conn = _connection()
+    with conn:
+        _write(conn, house_id, title, address)
+
+
+def rebuild_index():
+    """
+    从mysql重新构建索引
+    :return: 索引中的房屋数
+    """
+
+    conn = _connection()
+    count = 0
+    started_at = datetime.datetime.now()
+    with conn:
+        conn.execute("DELETE FROM house_fts")
+        query = House.query.with_entities(House.id, House.title, House.address)
+        for house_id, title, address in query.yield_per(conf.HOUSE_SEARCH_REBUILD_BATCH):
+            _write(conn, house_id, title, address)
+            count += 1
+        _set_synced(conn, started_at)
+    return count
+
+
+def sync_index():
+    """
+    从mysql补齐上次同步之后修改过的房屋， 包括其他主机上修改的房屋
+    :return: 更新的房屋数
+    """
+
+    conn = _connection()
+    synced_at = _get_synced(conn)
+    if synced_at is None:
+        return 0
+
+    count = 0
+    started_at = datetime.datetime.now()
+    # 往前多取一段时间， 覆盖上次同步时还没有提交的修改
+    since = synced_at - datetime.timedelta(seconds=conf.HOUSE_KEYWORD_SYNC_SECONDS)
+    with conn:
+        query = House.query.with_entities(House.id, House.title, House.address).filter(House.update_time >= since)
+        for house_id, title, address in query.yield_per(conf.HOUSE_SEARCH_REBUILD_BATCH):
+            _write(conn, house_id, title, address)
+            count += 1
+        _set_synced(conn, started_at)
+    return count
+
+
+def _maybe_sync():
+    """每个线程最多每HOUSE_KEYWORD_SYNC_SECONDS同步一次"""
+
+    now = time.time()
+    if now - getattr(_local, "checked_at", 0) < conf.HOUSE_KEYWORD_SYNC_SECONDS:
+        return
+    _local.checked_at = now
+    sync_index()
+
+
+def iter_matches(keyword, chunk_size=None):
+    """
+    关键字查询， 所有的词都需要命中， 按相关度从高到低分批返回房屋编号
+    最多返回HOUSE_KEYWORD_MAX_MATCHES个
+    """
+
+    tokens = tokenize(keyword)
+    if not tokens:
+        return
+
+    _maybe_sync()
+    chunk_size = chunk_size or conf.HOUSE_KEYWORD_CHUNK_SIZE
+    match = _match_query(tokens)
+    for offset in range(0, conf.HOUSE_KEYWORD_MAX_MATCHES, chunk_size):
+        rows = _connection().execute(
+            "SELECT rowid FROM house_fts WHERE house_fts MATCH ? ORDER BY bm25(house_fts, ?, 1.0) LIMIT ? OFFSET ?",
+            (match, conf.HOUSE_KEYWORD_TITLE_WEIGHT, min(chunk_size, conf.HOUSE_KEYWORD_MAX_MATCHES - offset),
+             offset)).fetchall()
+        if not rows:
+            return
+        yield [row[0] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+def search(keyword, limit=None):
+    """
+    关键字查询， 所有的词都需要命中
+    :return: 按相关度从高到低排列的房屋编号
+    """
+
+    house_ids = []
+    for chunk in iter_matches(keyword):
+        house_ids.extend(chunk)
+        if limit and len(house_ids) >= limit:
+            return house_ids[:limit]
+    return house_ids
+
+
+def filter_matches(keyword, filter_chunk):
+    """
+    关键字查询结果分批交给filter_chunk过滤， 每批只是一个小的IN查询
+    :param filter_chunk: filter_chunk(房屋编号列表) -> {房屋编号: 行}， 只包含满足其他条件的房屋
+    :return: 满足条件的行， 按相关度从高到低排列
+    """
+
+    rows = []
+    for chunk in iter_matches(keyword):
+        found = filter_chunk(chunk)
+        rows.extend(found[house_id] for house_id in chunk if house_id in found)
+    return rows
+
+
+@on_house_change
+def _index_changed_house(house_info, created):
+    index_house(house_info["house_id"], house_info["title"], house_info["address"])
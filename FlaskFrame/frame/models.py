@@ -101,6 +101,13 @@ class House(BaseModel, db.Model):
     """房屋信息"""
 
     __tablename__ = "ih_house_info"
+    __table_args__ = (
+        # 与房屋列表的区域过滤以及各个排序方式对应的联合索引
+        db.Index("ix_house_area_price", "area_id", "price"),
+        db.Index("ix_house_area_order_count", "area_id", "order_count"),
+        db.Index("ix_house_area_create_time", "area_id", "create_time"),
+        db.Index("ix_house_area_popularity", "area_id", "popularity", "order_count"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 房屋编号
     user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 房屋主人的用户编号
@@ -118,10 +125,23 @@ class House(BaseModel, db.Model):
     max_days = db.Column(db.Integer, default=0)  # 最多入住天数，0表示不限制
     order_count = db.Column(db.Integer, default=0)  # 预订完成的该房屋的订单数
     index_image_url = db.Column(db.String(256), default="")  # 房屋主图片的路径
+    facility_mask = db.Column(db.BigInteger, default=0)  # 房屋设施的位掩码， 第(设施编号-1)位表示有该设施
+    popularity = db.Column(db.Float, default=0)  # 按下单时间衰减的房屋热度， 由离线任务计算
     facilities = db.relationship("Facility", secondary=house_facility)  # 房屋的设施
     images = db.relationship("HouseImage")  # 房屋的图片
     orders = db.relationship("Order", backref="house")  # 房屋的订单
 
+    @staticmethod
+    def make_facility_mask(facility_ids):
+        """将设施编号列表转换为位掩码， 设施编号范围1~HOUSE_FACILITY_MAX_ID"""
+
+        mask = 0
+        for facility_id in facility_ids:
+            if not 0 < int(facility_id) <= conf.HOUSE_FACILITY_MAX_ID:
+                raise ValueError("facility id out of range: %s" % facility_id)
+            mask |= 1 << (int(facility_id) - 1)
+        return mask
+
     def to_basic_dict(self):
         """将基本信息转换为字典数据"""
 
@@ -247,3 +267,24 @@ class Order(BaseModel, db.Model):
             "comment": self.comment if self.comment else ""
         }
         return order_dict
+
+
+class HouseDailyStat(BaseModel, db.Model):
+    """房屋每日入住与收入的汇总"""
+
+    __tablename__ = "ih_house_daily_stat"
+
+    house_id = db.Column(db.Integer, db.ForeignKey("ih_house_info.id"), primary_key=True)  # 房屋编号
+    stat_date = db.Column(db.Date, primary_key=True)  # 统计日期
+    occupied = db.Column(db.Integer, nullable=False, default=0)  # 当天被预订的订单数
+    revenue = db.Column(db.Integer, nullable=False, default=0)  # 当天的收入，单位：分
+
+    def to_dict(self):
+        """将汇总信息转换为字典数据"""
+
+        stat_dict = {
+            "date": self.stat_date.strftime("%Y-%m-%d"),
+            "occupied": self.occupied,
+            "revenue": self.revenue
+        }
+        return stat_dict
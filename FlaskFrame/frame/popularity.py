@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+"""
+房屋热度
+离线任务按批次流式读取订单，每个订单按下单时间做指数衰减(半衰期HOUSE_POPULARITY_HALF_LIFE_DAYS天)，
+累加得到房屋的热度分数，写入ih_house_info.popularity，房屋列表的sk=booking按该列排序，
+避免成交订单数只增不减、老房源长期排在前面
+"""
+
+import datetime
+import time
+
+import numpy as np
+from sqlalchemy import bindparam
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import db
+from FlaskFrame.frame.models import House, Order
+
+
+def decay_weights(order_times, now, half_life_days):
+    """
+    订单的衰减权重， 下单时间越久权重越小
+    :param order_times: 下单时间戳数组， 单位：秒
+    :return: 权重数组， 刚下的订单权重为1
+    """
+
+    age_days = np.maximum(now - order_times, 0) / 86400.0
+    return np.exp2(-age_days / half_life_days)
+
+
+def compute_scores(house_ids, order_chunks, now, half_life_days):
+    """
+    流式累加房屋热度
+    :param house_ids: 有序的房屋编号数组
+    :param order_chunks: 可迭代的批次， 每批为(房屋编号数组， 下单时间戳数组)
+    :return: 与house_ids对应的热度数组
+    """
+
+    scores = np.zeros(len(house_ids), dtype=np.float64)
+    for order_houses, order_times in order_chunks:
+        positions = np.searchsorted(house_ids, order_houses)
+        found = (positions < len(house_ids)) & (house_ids[np.minimum(positions, len(house_ids) - 1)] == order_houses)
+        np.add.at(scores, positions[found], decay_weights(order_times[found], now, half_life_days))
+    return scores
+
+
+def _order_chunks(chunk_size):
+    """按批次流式读取订单的房屋编号和下单时间"""
+
+    query = Order.query.with_entities(Order.house_id, Order.create_time) \
+        .filter(Order.status.in_(conf.HOUSE_POPULARITY_ORDER_STATUS))
+
+    houses, times = [], []
+    for house_id, create_time in query.yield_per(chunk_size):
+        houses.append(house_id)
+        times.append(time.mktime(create_time.timetuple()))
+        if len(houses) >= chunk_size:
+            yield np.array(houses, dtype=np.int64), np.array(times, dtype=np.float64)
+            houses, times = [], []
+    if houses:
+        yield np.array(houses, dtype=np.int64), np.array(times, dtype=np.float64)
+
+
+def compute_popularity():
+    """
+    计算所有房屋的热度并批量写入mysql
+    :return: {house_id: 热度}
+    """
+
+    house_ids = np.array([house_id for house_id, in House.query.with_entities(House.id).order_by(House.id)],
+                         dtype=np.int64)
+    if not len(house_ids):
+        return {}
+
+    now = time.mktime(datetime.datetime.now().timetuple())
+    scores = compute_scores(house_ids, _order_chunks(conf.HOUSE_POPULARITY_CHUNK_SIZE),
+                            now, conf.HOUSE_POPULARITY_HALF_LIFE_DAYS)
+
+    stmt = House.__table__.update() \
+        .where(House.__table__.c.id == bindparam("hid")) \
+        .values(popularity=bindparam("score"))
+    rows = [{"hid": int(house_id), "score": float(score)} for house_id, score in zip(house_ids, scores)]
+    try:
+        for i in range(0, len(rows), conf.HOUSE_POPULARITY_CHUNK_SIZE):
+            db.session.execute(stmt, rows[i:i + conf.HOUSE_POPULARITY_CHUNK_SIZE])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return dict((row["hid"], row["score"]) for row in rows)
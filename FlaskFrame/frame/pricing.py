@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+"""
+房屋预订报价
+报价用到的单价、押金、最少/最多入住天数从房屋详情缓存house_info_<house_id>中读取，
+并在进程内做短时间的记忆化，拖动日期选择器时的连续报价不会访问mysql
+"""
+
+import json
+import time
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store
+from FlaskFrame.frame.events import on_house_change
+from FlaskFrame.frame.models import House
+
+
+# 进程内的报价参数缓存 house_id -> (过期时间, 报价参数)
+_pricing_cache = {}
+
+
+def _pricing_from_detail(detail):
+    return {
+        "price": int(detail["price"]),
+        "deposit": int(detail["deposit"] or 0),
+        "min_days": int(detail["min_days"] or 1),
+        "max_days": int(detail["max_days"] or 0),
+    }
+
+
+def get_pricing(house_id):
+    """
+    获取房屋的报价参数： 进程内缓存-详情缓存-mysql
+    :return: 报价参数字典， 房屋不存在时返回None
+    """
+
+    now = time.time()
+    cached = _pricing_cache.get(house_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    pricing = None
+    detail = redis_store.get("house_info_%s" % house_id)
+    if detail:
+        pricing = _pricing_from_detail(json.loads(detail))
+    else:
+        row = House.query.with_entities(House.price, House.deposit, House.min_days, House.max_days) \
+            .filter(House.id == house_id).first()
+        if row:
+            pricing = _pricing_from_detail(dict(zip(("price", "deposit", "min_days", "max_days"), row)))
+
+    if pricing is not None:
+        _pricing_cache[house_id] = (now + conf.HOUSE_PRICING_MEMO_SECONDS, pricing)
+    return pricing
+
+
+def forget_pricing(house_id):
+    """房屋信息修改后清除进程内的报价参数"""
+
+    _pricing_cache.pop(house_id, None)
+
+
+@on_house_change
+def _forget_changed_house(house_info, created):
+    """房屋提交修改后清除本进程的报价参数， 其他进程在HOUSE_PRICING_MEMO_SECONDS内过期"""
+
+    if not created:
+        forget_pricing(house_info["house_id"])
+
+
+def stay_days(start_date, end_date):
+    """入住天数，起止日期都计入"""
+
+    return (end_date - start_date).days + 1
+
+
+def quote(pricing, start_date, end_date):
+    """
+    计算一次预订的报价并校验入住天数
+    :param pricing: get_pricing()的返回值
+    :return: 报价字典， valid为False时errmsg说明原因
+    """
+
+    days = stay_days(start_date, end_date)
+    result = {
+        "start_date": start_date.strftime("%Y-%m-%d"),
+        "end_date": end_date.strftime("%Y-%m-%d"),
+        "days": days,
+        "price": pricing["price"],
+        "deposit": pricing["deposit"],
+        "valid": True,
+        "errmsg": "",
+    }
+
+    if days <= 0:
+        result.update(valid=False, errmsg="结束日期早于开始日期")
+    elif days < pricing["min_days"]:
+        result.update(valid=False, errmsg="少于最少入住天数%s天" % pricing["min_days"])
+    elif pricing["max_days"] and days > pricing["max_days"]:
+        result.update(valid=False, errmsg="超过最多入住天数%s天" % pricing["max_days"])
+
+    result["amount"] = days * pricing["price"] if result["valid"] else 0
+    result["total"] = result["amount"] + pricing["deposit"] if result["valid"] else 0
+    return result
@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+"""
+首页房屋排行
+redis有序集合house_index_rank只保存设置了主图片的房屋，分数为成交订单数，
+订单完成和上传主图片时增量更新，首页只需要ZREVRANGE加上房屋基本信息缓存
+"""
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, redis_scripts
+from FlaskFrame.frame.counters import get_pending_counts
+from FlaskFrame.frame.events import on_order_change
+from FlaskFrame.frame.models import House
+
+
+RANK_KEY = "house_index_rank"
+
+# 排行已经从mysql构建过的标记，区分没有数据和还没构建，过期后重新构建
+RANK_READY_KEY = "house_index_rank_ready"
+
+# 重新构建排行的锁，排行过期时只有一个请求访问mysql
+RANK_LOCK_KEY = "house_index_rank_lock"
+
+# 成员存在时才增加分数， 检查和增加在一次往返中完成
+# KEYS[1] 有序集合的键， ARGV[1] 成员， ARGV[2] 增加的分数
+_zincrby_if_exists = redis_scripts.register("zincrby_if_exists", """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return redis.call('ZINCRBY', KEYS[1], ARGV[2], ARGV[1])
+end
+return false
+""")
+
+
+def add_house(house_id, order_count=0):
+    """房屋设置主图片后加入排行"""
+
+    redis_store.zadd(RANK_KEY, order_count or 0, house_id)
+
+
+def incr_house(house_id, amount=1):
+    """房屋成交订单数变化， 只更新已经在排行中的房屋"""
+
+    _zincrby_if_exists([RANK_KEY], [house_id, amount])
+
+
+def rebuild_rank():
+    """
+    从mysql重新构建排行
+    :return: 排行中的房屋数
+    """
+
+    houses = House.query.with_entities(House.id, House.order_count) \
+        .filter(House.index_image_url != None, House.index_image_url != "").all()
+    pending = get_pending_counts([house_id for house_id, _ in houses])
+
+    pip = redis_store.pipeline()
+    pip.delete(RANK_KEY)
+    for house_id, order_count in houses:
+        pip.zadd(RANK_KEY, (order_count or 0) + pending.get(house_id, 0), house_id)
+    pip.setex(RANK_READY_KEY, conf.HOME_PAGE_RANK_REBUILD_SECONDS, 1)
+    pip.execute()
+    return len(houses)
+
+
+def _top_from_db(count):
+    """排行还没构建时直接从mysql查询"""
+
+    houses = House.query.with_entities(House.id) \
+        .filter(House.index_image_url != None, House.index_image_url != "") \
+        .order_by(House.order_count.desc()).limit(count).all()
+    return [house_id for house_id, in houses]
+
+
+def top_house_ids(count=None):
+    """
+    获取排行前count的房屋编号
+    排行过期时获取到锁的请求重新构建， 其他请求继续使用旧的排行， 还没有排行时直接查询mysql
+    """
+
+    count = count or conf.HOME_PAGE_MAX_HOUSES
+    if not redis_store.exists(RANK_READY_KEY):
+        token = redis_scripts.acquire_lock(RANK_LOCK_KEY, conf.HOME_PAGE_RANK_LOCK_SECONDS)
+        if token:
+            try:
+                rebuild_rank()
+            finally:
+                redis_scripts.release_lock(RANK_LOCK_KEY, token)
+        elif not redis_store.exists(RANK_KEY):
+            return _top_from_db(count)
+    return [int(house_id) for house_id in redis_store.zrevrange(RANK_KEY, 0, count - 1)]
+
+
+@on_order_change
+def _rank_completed_order(order_info, old_status):
+    """订单变为已完成时加分， 从已完成变为其他状态时减分"""
+
+    if order_info["status"] == "COMPLETE" and old_status != "COMPLETE":
+        incr_house(order_info["house_id"], 1)
+    elif order_info["status"] != "COMPLETE" and old_status == "COMPLETE":
+        incr_house(order_info["house_id"], -1)
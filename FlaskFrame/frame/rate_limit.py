@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+"""
+接口限流
+RATE_LIMITS按接口配置限制条件 (维度, 次数, 窗口秒数)，维度为ip、mobile(手机号)或route(接口整体)。
+每个条件对应一个有序集合，成员为请求时间，lua脚本一次往返完成：清除窗口外的请求、检查所有条件、全部通过时才记录本次请求。
+限流在视图函数之前执行，被限制的请求不会生成图片验证码或发送短信；redis不可用时放行
+"""
+
+import logging
+import time
+import uuid
+
+from flask import request
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_scripts
+
+
+# 滑动窗口限流
+# KEYS[i] 第i个条件的有序集合， ARGV[1] 当前时间(毫秒)， ARGV[2] 本次请求的成员，
+# ARGV[2 + 2i - 1] 第i个条件的次数， ARGV[2 + 2i] 第i个条件的窗口(毫秒)
+# 返回 0: 通过， i: 第i个条件超限
+_sliding_window = redis_scripts.register("sliding_window", """
+local now = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 + 2 * i - 1])
+    local window = tonumber(ARGV[2 + 2 * i])
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    if redis.call('ZCARD', key) >= limit then
+        return i
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[2])
+    redis.call('PEXPIRE', key, tonumber(ARGV[2 + 2 * i]))
+end
+return 0
+""")
+
+
+def _client_ip():
+    if conf.RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("X-Forwarded-For", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.remote_addr or "-"
+
+
+def _mobile():
+    mobile = (request.view_args or {}).get("mobile")
+    if not mobile and request.mimetype == "application/json":
+        data = request.get_json(silent=True) or {}
+        mobile = data.get("mobile") if isinstance(data, dict) else None
+    return mobile
+
+
+def _dimension_value(dimension):
+    if dimension == "ip":
+        return _client_ip()
+    if dimension == "mobile":
+        return _mobile()
+    return "all"
+
+
+def check(endpoint=None):
+    """
+    检查当前请求是否超过限流条件
+    :return: 是否放行
+    """
+
+    endpoint = endpoint or request.endpoint
+    rules = conf.RATE_LIMITS.get(endpoint)
+    if not rules:
+        return True
+
+    keys = []
+    args = [int(time.time() * 1000), uuid.uuid4().hex]
+    for dimension, limit, window in rules:
+        value = _dimension_value(dimension)
+        # 请求中没有该维度时(例如没有手机号)跳过该条件
+        if value is None:
+            continue
+        keys.append("rate_limit_%s_%s_%s_%s" % (endpoint, dimension, window, value))
+        args.extend([limit, int(window * 1000)])
+    if not keys:
+        return True
+
+    try:
+        exceeded = int(_sliding_window(keys, args))
+    except Exception as e:
+        logging.error(e)
+        return True
+
+    if exceeded:
+        logging.warning("rate limited %s %s" % (endpoint, keys[exceeded - 1]))
+    return exceeded == 0
@@ -0,0 +1,176 @@
+# -*- coding:utf-8 -*-
+"""
+redis客户端
+所有redis的使用者(redis_store、flask-session)都通过get_client()获取客户端，共用同一个连接池。
+连接池按进程创建，gunicorn等fork出的子进程第一次使用时重新建立自己的连接池，不会共用父进程的socket。
+连接池大小、超时、重试次数由create_app中init_app(app)从app的配置读取，没有app时使用Config的默认值。
+连接出错时只重试只读命令，写命令可能已经在redis执行过，重试会重复执行。
+每个命令记录耗时，慢命令记录日志，指标可以通过metrics()获取
+"""
+
+import logging
+import os
+import threading
+import time
+
+import redis
+from redis.client import StrictPipeline
+
+from FlaskFrame.config import conf
+
+
+class RedisMetrics(object):
+    """按命令统计的次数、耗时和错误数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def record(self, command, elapsed, error=False):
+        with self._lock:
+            stats = self._commands.setdefault(command, {"count": 0, "errors": 0, "time_total": 0.0, "time_max": 0.0})
+            stats["count"] += 1
+            stats["time_total"] += elapsed
+            stats["time_max"] = max(stats["time_max"], elapsed)
+            if error:
+                stats["errors"] += 1
+        if elapsed > conf.REDIS_SLOW_SECONDS:
+            logging.warning("slow redis command %s %.3fs" % (command, elapsed))
+
+    def snapshot(self):
+        with self._lock:
+            return dict((command, dict(stats)) for command, stats in self._commands.items())
+
+
+redis_metrics = RedisMetrics()
+
+# 连接出错时可以安全重试的只读命令
+RETRY_COMMANDS = frozenset([
+    "GET", "MGET", "EXISTS", "TTL", "PTTL", "TYPE", "STRLEN", "PING",
+    "HGET", "HMGET", "HGETALL", "HEXISTS", "HLEN", "HKEYS", "HVALS",
+    "LLEN", "LRANGE", "LINDEX", "SCARD", "SMEMBERS", "SISMEMBER",
+    "ZCARD", "ZSCORE", "ZRANK", "ZREVRANK", "ZRANGE", "ZREVRANGE", "ZRANGEBYSCORE", "ZREVRANGEBYSCORE", "ZCOUNT",
+])
+
+# 从app配置读取的连接参数
+SETTINGS = ("REDIS_HOST", "REDIS_PORT", "REDIS_MAX_CONNECTIONS", "REDIS_SOCKET_TIMEOUT",
+            "REDIS_SOCKET_CONNECT_TIMEOUT", "REDIS_RETRY_ON_TIMEOUT", "REDIS_RETRY_ATTEMPTS", "REDIS_RETRY_BACKOFF")
+
+_settings = {}
+
+# 当前进程的连接池， fork之后进程号变化时重新创建
+_pool = [None, None]
+_pool_lock = threading.Lock()
+
+
+def init_app(app):
+    """从app的配置读取连接参数， 已经创建的连接池按新的参数重新创建"""
+
+    _settings.update((name, app.config[name]) for name in SETTINGS if name in app.config)
+    with _pool_lock:
+        if _pool[1] is not None and _pool[0] == os.getpid():
+            _pool[1].disconnect()
+        _pool[:] = [None, None]
+
+
+def _setting(name):
+    return _settings[name] if name in _settings else getattr(conf.Config, name)
+
+
+def get_pool():
+    """获取当前进程共用的连接池"""
+
+    pid = os.getpid()
+    if _pool[0] != pid:
+        with _pool_lock:
+            if _pool[0] != pid:
+                _pool[:] = [pid, redis.ConnectionPool(
+                    host=_setting("REDIS_HOST"),
+                    port=_setting("REDIS_PORT"),
+                    max_connections=_setting("REDIS_MAX_CONNECTIONS"),
+                    socket_timeout=_setting("REDIS_SOCKET_TIMEOUT"),
+                    socket_connect_timeout=_setting("REDIS_SOCKET_CONNECT_TIMEOUT"),
+                    socket_keepalive=True,
+                    retry_on_timeout=_setting("REDIS_RETRY_ON_TIMEOUT"),
+                )]
+    return _pool[1]
+
+
+class InstrumentedPipeline(StrictPipeline):
+    """记录整个pipeline执行耗时的pipeline"""
+
+    def execute(self, raise_on_error=True):
+        start = time.time()
+        error = False
+        try:
+            return StrictPipeline.execute(self, raise_on_error)
+        except redis.RedisError:
+            error = True
+            raise
+        finally:
+            redis_metrics.record("PIPELINE", time.time() - start, error)
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """使用进程共用连接池、连接失败时重试、记录命令耗时的客户端"""
+
+    def __init__(self):
+        redis.StrictRedis.__init__(self, connection_pool=get_pool())
+
+    @property
+    def connection_pool(self):
+        return get_pool()
+
+    @connection_pool.setter
+    def connection_pool(self, value):
+        # 连接池总是按进程获取， 忽略StrictRedis.__init__的赋值
+        pass
+
+    def execute_command(self, *args, **options):
+        command = args[0]
+        attempts = _setting("REDIS_RETRY_ATTEMPTS") if command.upper() in RETRY_COMMANDS else 0
+        start = time.time()
+        for attempt in range(attempts + 1):
+            try:
+                result = redis.StrictRedis.execute_command(self, *args, **options)
+                break
+            except redis.ConnectionError:
+                # 只读命令连接出错时按指数退避重试， 超时是否重试由连接池的retry_on_timeout决定
+                if attempt >= attempts:
+                    redis_metrics.record(command, time.time() - start, error=True)
+                    raise
+                time.sleep(_setting("REDIS_RETRY_BACKOFF") * (2 ** attempt))
+            except redis.RedisError:
+                redis_metrics.record(command, time.time() - start, error=True)
+                raise
+        redis_metrics.record(command, time.time() - start)
+        return result
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+_client = []
+
+
+def get_client():
+    """获取redis客户端， 客户端本身不持有连接， 可以在fork之前创建"""
+
+    if not _client:
+        _client.append(InstrumentedRedis())
+    return _client[0]
+
+
+def metrics():
+    """当前进程的redis指标"""
+
+    pool = get_pool()
+    return {
+        "pool": {
+            "created": pool._created_connections,
+            "available": len(pool._available_connections),
+            "in_use": len(pool._in_use_connections),
+            "max_connections": pool.max_connections,
+        },
+        "commands": redis_metrics.snapshot(),
+    }
@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+"""
+redis的lua脚本
+需要原子完成的多步操作写成lua脚本，一次往返完成，不会被其他客户端插入。
+脚本在应用启动时用SCRIPT LOAD预加载，调用时使用EVALSHA，redis重启或执行过SCRIPT FLUSH返回NOSCRIPT时重新加载再执行
+"""
+
+import hashlib
+import logging
+import uuid
+
+from redis.exceptions import NoScriptError
+
+from FlaskFrame.frame import redis_store
+
+
+class LuaScript(object):
+    """使用EVALSHA执行的lua脚本"""
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def load(self, client=None):
+        (client or redis_store).script_load(self.source)
+
+    def __call__(self, keys=(), args=(), client=None):
+        client = client or redis_store
+        keys, args = list(keys), list(args)
+        try:
+            return client.evalsha(self.sha, len(keys), *(keys + args))
+        except NoScriptError:
+            self.load(client)
+            return client.evalsha(self.sha, len(keys), *(keys + args))
+
+
+# 已注册的脚本
+_scripts = []
+
+
+def register(name, source):
+    script = LuaScript(name, source)
+    _scripts.append(script)
+    return script
+
+
+def preload():
+    """预加载所有脚本， redis不可用时只记录日志， 调用时会再加载"""
+
+    for script in _scripts:
+        try:
+            script.load()
+        except Exception as e:
+            logging.error("load redis script %s failed: %s" % (script.name, e))
+
+
+# 比较并删除验证码
+# KEYS[1] 验证码的键， ARGV[1] 用户输入的验证码， ARGV[2] 是否忽略大小写， ARGV[3] 不一致时是否也删除
+# 返回 1: 一致并已删除， 0: 验证码不存在(过期)， -1: 不一致
+_compare_and_delete = register("compare_and_delete", """
+local real = redis.call('GET', KEYS[1])
+if not real then
+    return 0
+end
+local expected = ARGV[1]
+if ARGV[2] == '1' then
+    real = string.lower(real)
+    expected = string.lower(expected)
+end
+if real == expected then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+if ARGV[3] == '1' then
+    redis.call('DEL', KEYS[1])
+end
+return -1
+""")
+
+# 设置hash的字段并设置整个hash的有效期
+# KEYS[1] hash的键， ARGV[1] 字段， ARGV[2] 值， ARGV[3] 有效期，单位：秒
+_hset_expire = register("hset_expire", """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+""")
+
+# 持有者释放锁， 锁已过期并被其他进程获取时不删除
+# KEYS[1] 锁的键， ARGV[1] 获取锁时写入的令牌
+_release_lock = register("release_lock", """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def compare_and_delete(key, code, ignore_case=False, delete_on_mismatch=False):
+    """
+    校验验证码， 一致时删除
+    :param ignore_case: 是否忽略大小写
+    :param delete_on_mismatch: 不一致时是否也删除， 图片验证码只能使用一次
+    :return: 1 一致， 0 不存在， -1 不一致
+    """
+
+    return int(_compare_and_delete([key], [code, "1" if ignore_case else "0", "1" if delete_on_mismatch else "0"]))
+
+
+def hset_expire(key, field, value, expires):
+    """设置hash的字段， 同时设置hash的有效期"""
+
+    return _hset_expire([key], [field, value, int(expires)])
+
+
+def acquire_lock(key, expires):
+    """
+    获取锁
+    :param expires: 锁的有效期， 单位：秒
+    :return: 令牌， 释放锁时使用， 锁被占用时返回None
+    """
+
+    token = uuid.uuid4().hex
+    if redis_store.set(key, token, nx=True, ex=int(expires)):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    """释放acquire_lock()获取的锁， 锁已经不属于自己时不处理"""
+
+    return int(_release_lock([key], [token]))
@@ -0,0 +1,264 @@
+# -*- coding:utf-8 -*-
+"""
+房屋列表的redis有序集合索引
+每个区域以及全部区域各有四个有序集合，分别以单价、成交订单数、热度、发布时间为分数:
+    house_search_<price|order_count|popularity|create_time>_<area_id|all>
+列表分页直接ZRANGE/ZREVRANGE，区域过滤只是选择不同的key，结果用房屋基本信息缓存补全，
+由房屋/订单写入回调保持同步，可以通过manage.py rebuild_search_index重建，
+重建时写入临时的key，完成后一次RENAME替换，重建期间仍然使用旧的索引
+"""
+
+import time
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store, redis_scripts
+from FlaskFrame.frame.counters import get_pending_counts
+from FlaskFrame.frame.events import on_house_change, on_order_change
+from FlaskFrame.frame.house_cache import get_basic_dicts
+from FlaskFrame.frame.models import Area, House
+
+
+SCORE_FIELDS = ("price", "order_count", "popularity", "create_time")
+
+# 列表排序参数sk对应的分数字段以及是否倒序
+SORT_KEYS = {
+    "booking": ("popularity", True),
+    "price-inc": ("price", False),
+    "price-des": ("price", True),
+    "new": ("create_time", True),
+}
+
+# 热度有序集合的分数 = 热度(保留3位小数) * _TIE_RANGE + 成交订单数， 热度相同时按成交订单数排序
+_POPULARITY_SCALE = 1000
+_TIE_RANGE = 10 ** 6
+
+# 索引已经从mysql构建过的标记
+INDEX_READY_KEY = "house_search_ready"
+
+# 房屋所属区域 house_id -> area_id， 订单回调里没有区域信息， 需要从这里查
+HOUSE_AREA_KEY = "house_search_areas"
+
+# 重建索引的锁， 同一时间只有一个进程重建
+INDEX_LOCK_KEY = "house_search_rebuild_lock"
+
+# 重建时临时key的后缀
+_BUILDING_SUFFIX = "_building"
+
+
+def _index_key(field, area_id=None):
+    return "house_search_%s_%s" % (field, area_id or "all")
+
+
+def _timestamp(value):
+    return time.mktime(value.timetuple()) if value else 0
+
+
+def enabled():
+    """是否使用redis索引查询房屋列表"""
+
+    return conf.HOUSE_SEARCH_BACKEND == "redis"
+
+
+def booking_score(popularity, order_count):
+    """热度有序集合的分数"""
+
+    tie = max(0, min(int(order_count or 0), _TIE_RANGE - 1))
+    return int(round((popularity or 0) * _POPULARITY_SCALE)) * _TIE_RANGE + tie
+
+
+def _popularity_from_score(score):
+    return (score // _TIE_RANGE) / float(_POPULARITY_SCALE) if score else 0
+
+
+def _add(pip, house_id, area_id, scores, suffix=""):
+    keys = []
+    for field in SCORE_FIELDS:
+        score = booking_score(scores["popularity"], scores["order_count"]) if field == "popularity" else scores[field]
+        keys.append(_index_key(field) + suffix)
+        keys.append(_index_key(field, area_id) + suffix)
+        pip.zadd(keys[-2], score, house_id)
+        pip.zadd(keys[-1], score, house_id)
+    keys.append(HOUSE_AREA_KEY + suffix)
+    pip.hset(keys[-1], house_id, area_id)
+    return keys
+
+
+def index_house(house_id, area_id, price, order_count, create_time, popularity=0):
+    """把房屋加入索引， 已存在时更新分数， 区域变化时从原区域中删除"""
+
+    old_area_id = redis_store.hget(HOUSE_AREA_KEY, house_id)
+
+    pip = redis_store.pipeline()
+    if old_area_id is not None and int(old_area_id) != int(area_id):
+        for field in SCORE_FIELDS:
+            pip.zrem(_index_key(field, int(old_area_id)), house_id)
+    _add(pip, house_id, area_id, {
+        "price": price or 0,
+        "order_count": order_count or 0,
+        "popularity": popularity or 0,
+        "create_time": _timestamp(create_time),
+    })
+    pip.execute()
+
+
+def incr_order_count(house_id, amount=1):
+    """房屋成交订单数变化， 只更新已经在索引中的房屋"""
+
+    area_id = redis_store.hget(HOUSE_AREA_KEY, house_id)
+    if area_id is None:
+        return
+
+    # 热度的分数包含成交订单数
+    pip = redis_store.pipeline()
+    for field in ("order_count", "popularity"):
+        pip.zincrby(_index_key(field), house_id, amount)
+        pip.zincrby(_index_key(field, int(area_id)), house_id, amount)
+    pip.execute()
+
+
+def set_popularity(scores):
+    """
+    离线任务计算出热度后更新索引， 只更新已经在索引中的房屋
+    :param scores: {house_id: 热度}
+    """
+
+    if not scores or not redis_store.exists(INDEX_READY_KEY):
+        return
+
+    house_ids = list(scores.keys())
+    pip = redis_store.pipeline(transaction=False)
+    pip.hmget(HOUSE_AREA_KEY, house_ids)
+    for house_id in house_ids:
+        pip.zscore(_index_key("order_count"), house_id)
+    results = pip.execute()
+
+    pip = redis_store.pipeline(transaction=False)
+    for house_id, area_id, order_count in zip(house_ids, results[0], results[1:]):
+        if area_id is None:
+            continue
+        score = booking_score(scores[house_id], order_count)
+        pip.zadd(_index_key("popularity"), score, house_id)
+        pip.zadd(_index_key("popularity", int(area_id)), score, house_id)
+    pip.execute()
+
+
+def rebuild_index():
+    """
+    从mysql重新构建索引
+    1. 获取重建锁， 其他进程正在重建时不处理
+    2. 分批查询房屋， 合并尚未写回mysql的订单数， 写入临时的key
+    3. 在一个事务中用临时的key替换正在使用的key， 没有房屋的区域删除原来的key
+    :return: 索引中的房屋数， 其他进程正在重建时返回None
+    """
+
+    token = redis_scripts.acquire_lock(INDEX_LOCK_KEY, conf.HOUSE_SEARCH_REBUILD_LOCK_SECONDS)
+    if not token:
+        return None
+    try:
+        return _rebuild_index()
+    finally:
+        redis_scripts.release_lock(INDEX_LOCK_KEY, token)
+
+
+def _rebuild_index():
+    keys = [HOUSE_AREA_KEY] + [_index_key(field) for field in SCORE_FIELDS]
+    for area_id, in Area.query.with_entities(Area.id).all():
+        keys.extend(_index_key(field, area_id) for field in SCORE_FIELDS)
+    redis_store.delete(*[key + _BUILDING_SUFFIX for key in keys])
+
+    count = 0
+    built = set()
+    query = House.query.with_entities(House.id, House.area_id, House.price, House.order_count,
+                                      House.popularity, House.create_time)
+    batch = []
+
+    def add_batch():
+        pending = get_pending_counts([row[0] for row in batch])
+        pip = redis_store.pipeline(transaction=False)
+        for house_id, area_id, price, order_count, popularity, create_time in batch:
+            built.update(_add(pip, house_id, area_id, {
+                "price": price or 0,
+                "order_count": (order_count or 0) + pending.get(house_id, 0),
+                "popularity": popularity or 0,
+                "create_time": _timestamp(create_time),
+            }, _BUILDING_SUFFIX))
+        pip.execute()
+
+    for row in query.yield_per(conf.HOUSE_SEARCH_REBUILD_BATCH):
+        batch.append(row)
+        count += 1
+        if len(batch) >= conf.HOUSE_SEARCH_REBUILD_BATCH:
+            add_batch()
+            batch = []
+    if batch:
+        add_batch()
+
+    pip = redis_store.pipeline()
+    for key in set(keys) | set(key[:-len(_BUILDING_SUFFIX)] for key in built):
+        if key + _BUILDING_SUFFIX in built:
+            pip.rename(key + _BUILDING_SUFFIX, key)
+        else:
+            pip.delete(key)
+    pip.set(INDEX_READY_KEY, 1)
+    pip.execute()
+    return count
+
+
+def search(area_id, sort_key, page, per_page=None):
+    """
+    分页查询房屋列表
+    索引还没有构建时， 获取到锁的请求构建索引， 其他请求返回None， 由调用者改用mysql查询
+    :param area_id: 区域编号， 为空表示全部区域
+    :param sort_key: 排序参数sk
+    :param page: 页码， 从1开始
+    :return: (房屋基本信息列表， 总页数)， 索引不可用时返回None
+    """
+
+    if page < 1:
+        raise ValueError("page must be >= 1")
+
+    per_page = per_page or conf.HOUSE_LIST_PAGE_CAPACITY
+    if not redis_store.exists(INDEX_READY_KEY) and rebuild_index() is None:
+        return None
+
+    field, desc = SORT_KEYS.get(sort_key, SORT_KEYS["new"])
+    key = _index_key(field, area_id)
+
+    start = (page - 1) * per_page
+    pip = redis_store.pipeline(transaction=False)
+    pip.zcard(key)
+    if desc:
+        pip.zrevrange(key, start, start + per_page - 1)
+    else:
+        pip.zrange(key, start, start + per_page - 1)
+    total, house_ids = pip.execute()
+
+    total_page = (total + per_page - 1) // per_page
+    return get_basic_dicts(house_ids), total_page
+
+
+@on_house_change
+def _index_changed_house(house_info, created):
+    """房屋新增或修改后更新索引， 修改时保留索引中已经合并了增量的订单数以及离线计算的热度"""
+
+    if not redis_store.exists(INDEX_READY_KEY):
+        return
+
+    order_count, popularity = None, 0
+    if not created:
+        order_count = redis_store.zscore(_index_key("order_count"), house_info["house_id"])
+        popularity = _popularity_from_score(redis_store.zscore(_index_key("popularity"), house_info["house_id"]))
+    if order_count is None:
+        order_count = house_info["order_count"]
+    index_house(house_info["house_id"], house_info["area_id"], house_info["price"],
+                order_count, house_info["create_time"], popularity)
+
+
+@on_order_change
+def _index_completed_order(order_info, old_status):
+    """订单变为已完成时加分， 从已完成变为其他状态时减分"""
+
+    if order_info["status"] == "COMPLETE" and old_status != "COMPLETE":
+        incr_order_count(order_info["house_id"], 1)
+    elif order_info["status"] != "COMPLETE" and old_status == "COMPLETE":
+        incr_order_count(order_info["house_id"], -1)
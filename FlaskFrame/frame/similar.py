@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+"""
+相似房屋
+离线任务把房屋的单价、容纳人数、房间数、面积、区域、设施转换为归一化的特征向量，
+按内存预算分块做float32矩阵乘法计算余弦相似度，每个房屋取相似度最高的K个房屋编号存入redis: house_similar_<house_id>，
+详情页的相似房屋接口只需要读取这个列表
+"""
+
+import json
+
+import numpy as np
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import redis_store
+from FlaskFrame.frame.models import House
+
+
+def _similar_key(house_id):
+    return "house_similar_%s" % house_id
+
+
+def _zscore(values):
+    std = values.std()
+    return (values - values.mean()) / std if std > 0 else np.zeros_like(values)
+
+
+def build_features(rows):
+    """
+    构建特征矩阵
+    :param rows: [(id, area_id, price, capacity, room_count, acreage, facility_mask), ...]
+    :return: (房屋编号数组， 按行归一化的特征矩阵)
+    """
+
+    count = len(rows)
+    columns = list(zip(*rows)) if rows else [()] * 7
+    house_ids = np.array(columns[0], dtype=np.int64)
+
+    # 数值特征， 单价和面积取对数， 再标准化
+    numeric = np.column_stack([
+        _zscore(np.log1p(np.array(columns[2], dtype=np.float64))),
+        _zscore(np.array(columns[3], dtype=np.float64)),
+        _zscore(np.array(columns[4], dtype=np.float64)),
+        _zscore(np.log1p(np.array(columns[5], dtype=np.float64))),
+    ]) * conf.HOUSE_SIMILAR_NUMERIC_WEIGHT
+
+    # 区域独热编码
+    area_ids = np.array(columns[1], dtype=np.int64)
+    _, area_index = np.unique(area_ids, return_inverse=True)
+    areas = np.zeros((count, area_index.max() + 1 if count else 0), dtype=np.float64)
+    areas[np.arange(count), area_index] = conf.HOUSE_SIMILAR_AREA_WEIGHT
+
+    # 设施位掩码展开为64列
+    masks = np.array(columns[6], dtype=np.int64).astype(np.uint64)
+    facilities = np.unpackbits(masks.view(np.uint8).reshape(count, 8), axis=1).astype(np.float64)
+    facilities *= conf.HOUSE_SIMILAR_FACILITY_WEIGHT
+
+    features = np.hstack([numeric, areas, facilities])
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return house_ids, (features / norms).astype(np.float32)
+
+
+def _block_rows(count, block_size, memory_bytes):
+    """每块的行数， 相似度矩阵(float32)和argpartition的下标矩阵(int64)不超过内存预算"""
+
+    return max(1, min(block_size, memory_bytes // (max(count, 1) * 12)))
+
+
+def top_k_neighbors(features, k, block_size=None, memory_bytes=None):
+    """
+    分块计算余弦相似度， 返回每行最相似的k行(不含自身)
+    :param memory_bytes: 每块计算的内存预算， 房屋很多时自动减少每块的行数
+    :return: (count, k)的行号矩阵， 按相似度从高到低排列
+    """
+
+    count = features.shape[0]
+    k = min(k, count - 1)
+    if k <= 0:
+        return np.zeros((count, 0), dtype=np.int64)
+
+    block_rows = _block_rows(count, block_size or conf.HOUSE_SIMILAR_BLOCK_SIZE,
+                             memory_bytes or conf.HOUSE_SIMILAR_MEMORY_BYTES)
+    neighbors = np.empty((count, k), dtype=np.int64)
+    for start in range(0, count, block_rows):
+        end = min(start + block_rows, count)
+        sims = features[start:end].dot(features.T)
+        sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+        # 先取出最大的k个(分区后位于最后k列)， 再只对这k个排序， 不复制取反后的矩阵
+        candidates = np.argpartition(sims, count - k, axis=1)[:, count - k:]
+        candidate_sims = np.take_along_axis(sims, candidates, axis=1)
+        order = np.argsort(candidate_sims, axis=1)[:, ::-1]
+        neighbors[start:end] = np.take_along_axis(candidates, order, axis=1)
+    return neighbors
+
+
+def build_similar():
+    """
+    计算所有房屋的相似房屋并写入redis
+    :return: 处理的房屋数
+    """
+
+    rows = House.query.with_entities(House.id, House.area_id, House.price, House.capacity,
+                                      House.room_count, House.acreage, House.facility_mask).all()
+    rows = [tuple(value or 0 for value in row) for row in rows]
+    house_ids, features = build_features(rows)
+    neighbors = top_k_neighbors(features, conf.HOUSE_SIMILAR_COUNT)
+
+    pip = redis_store.pipeline(transaction=False)
+    for index, house_id in enumerate(house_ids):
+        similar_ids = [int(house_ids[row]) for row in neighbors[index]]
+        pip.setex(_similar_key(int(house_id)), conf.HOUSE_SIMILAR_REDIS_EXPIRES, json.dumps(similar_ids))
+        if (index + 1) % conf.HOUSE_SIMILAR_BLOCK_SIZE == 0:
+            pip.execute()
+    pip.execute()
+    return len(house_ids)
+
+
+def get_similar_ids(house_id):
+    """获取房屋的相似房屋编号， 任务没有计算过时返回空列表"""
+
+    value = redis_store.get(_similar_key(house_id))
+    return json.loads(value) if value else []
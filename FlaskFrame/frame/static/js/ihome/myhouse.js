@@ -10,14 +10,31 @@ $(document).ready(function(){
                 $(".auth-warn").show();
                 return;
             }
-            // 已认证的用户，请求其之前发布的房源信息
-            $.get("/api/v1.0/user/houses", function(resp){
-                if ("0" == resp.errno) {
-                    $("#houses-list").html(template("houses-list-tmpl", {houses:resp.data.houses}));
-                } else {
-                    $("#houses-list").html(template("houses-list-tmpl", {houses:[]}));
+            // 已认证的用户，分页请求其之前发布的房源信息，滚动到底部时加载下一页
+            var houses = [];
+            var cur_page = 0;
+            var total_page = 1;
+            var querying = false;
+            var loadHouses = function() {
+                querying = true;
+                $.get("/api/v1.0/user/houses", {p:cur_page+1}, function(resp){
+                    querying = false;
+                    if ("0" == resp.errno) {
+                        houses = houses.concat(resp.data.houses);
+                        cur_page = resp.data.current_page;
+                        total_page = resp.data.total_page;
+                    }
+                    $("#houses-list").html(template("houses-list-tmpl", {houses:houses}));
+                });
+            };
+            loadHouses();
+            window.onscroll = function(){
+                var b = document.documentElement.scrollTop==0? document.body.scrollTop : document.documentElement.scrollTop;
+                var c = document.documentElement.scrollTop==0? document.body.scrollHeight : document.documentElement.scrollHeight;
+                if (c-b < $(window).height()+50 && !querying && cur_page < total_page) {
+                    loadHouses();
                 }
-            });
+            };
         }
     });
 })
\ No newline at end of file
@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+"""
+搜索框的前缀联想
+把房屋标题、地址以及区域名称规范化之后放在进程内的有序列表中，查询时二分查找前缀的起点，再向后扫描，
+单次查询只访问命中的少量条目。列表在第一次查询时从mysql构建，之后由房屋写入回调增量更新，
+其他进程的写入通过定时重建同步，条目数和文本长度都有上限。
+过期后由一个后台线程重建，重建期间继续使用旧的列表；列表只整体替换，不原地修改，查询不需要加锁
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import db
+from FlaskFrame.frame.events import on_house_change
+from FlaskFrame.frame.models import Area, House
+
+
+def normalize(text):
+    """规范化文本： 去掉空白， 转换为小写， 截断长度"""
+
+    return "".join((text or "").split()).lower()[:conf.HOUSE_SUGGEST_MAX_TEXT]
+
+
+class SuggestIndex(object):
+    """前缀联想的有序索引， 条目为 (规范化文本, 原文本, 类型, 编号)"""
+
+    def __init__(self):
+        self._entries = []
+        self._by_house = {}
+        self._built_at = 0
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程重建
+        self._build_lock = threading.Lock()
+        # 重建期间修改的房屋， 重建完成后重新应用 house_id -> (标题, 地址)
+        self._pending = None
+
+    @staticmethod
+    def _house_entries(house_id, title, address):
+        entries = []
+        for kind, text in (("title", title), ("address", address)):
+            key = normalize(text)
+            if key:
+                entries.append((key, text[:conf.HOUSE_SUGGEST_MAX_TEXT], kind, house_id))
+        return entries
+
+    def build(self):
+        """
+        从mysql构建索引
+        :return: 条目数
+        """
+
+        with self._lock:
+            self._pending = {}
+        try:
+            entries = []
+            by_house = {}
+            for area_id, name in Area.query.with_entities(Area.id, Area.name).all():
+                key = normalize(name)
+                if key:
+                    entries.append((key, name, "area", area_id))
+
+            # 每个房屋最多两个条目， 条目数超过上限时优先保留成交量高的房屋
+            query = House.query.with_entities(House.id, House.title, House.address) \
+                .order_by(House.order_count.desc()).limit(conf.HOUSE_SUGGEST_MAX_ENTRIES // 2)
+            for house_id, title, address in query:
+                house_entries = self._house_entries(house_id, title, address)
+                by_house[house_id] = house_entries
+                entries.extend(house_entries)
+            entries.sort()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            self._entries = entries
+            self._by_house = by_house
+            self._built_at = time.time()
+            pending, self._pending = self._pending or {}, None
+            for house_id, (title, address) in pending.items():
+                self._update_locked(house_id, title, address)
+        return len(self._entries)
+
+    def _rebuild(self, app):
+        """获取重建锁之后构建， 其他线程正在重建时不处理"""
+
+        if not self._build_lock.acquire(False):
+            return
+        try:
+            with app.app_context():
+                try:
+                    self.build()
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            # 重建失败时继续使用旧的列表， 下个周期再重建， 避免每次查询都启动线程
+            logging.error(e)
+            self._built_at = time.time()
+        finally:
+            self._build_lock.release()
+
+    def _rebuild_in_background(self):
+        """在后台线程中重建， 继续使用旧的列表"""
+
+        thread = threading.Thread(target=self._rebuild, args=(current_app._get_current_object(),),
+                                  name="suggest-index-rebuilder")
+        thread.daemon = True
+        thread.start()
+
+    def _update_locked(self, house_id, title, address):
+        """复制列表修改后整体替换， 正在查询的线程仍然读取旧的列表"""
+
+        entries = list(self._entries)
+        for entry in self._by_house.pop(house_id, []):
+            index = bisect.bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+
+        house_entries = self._house_entries(house_id, title, address)
+        if len(entries) + len(house_entries) <= conf.HOUSE_SUGGEST_MAX_ENTRIES:
+            for entry in house_entries:
+                bisect.insort(entries, entry)
+            self._by_house[house_id] = house_entries
+        self._entries = entries
+
+    def update_house(self, house_id, title, address):
+        """新增或修改房屋后更新条目， 超过条目上限时不再加入"""
+
+        if not self._built_at and self._pending is None:
+            return
+
+        with self._lock:
+            if self._pending is not None:
+                self._pending[house_id] = (title, address)
+            if self._built_at:
+                self._update_locked(house_id, title, address)
+
+    def lookup(self, prefix, limit=None):
+        """
+        查询以prefix开头的条目， 相同的文本只返回一次
+        :return: [{"text": 文本, "type": 类型, "id": 编号}, ...]
+        """
+
+        limit = limit or conf.HOUSE_SUGGEST_LIMIT
+        if not self._built_at:
+            # 第一次查询同步构建， 同时到达的请求等待构建完成
+            with self._build_lock:
+                if not self._built_at:
+                    self.build()
+        elif time.time() - self._built_at > conf.HOUSE_SUGGEST_REBUILD_SECONDS and not self._build_lock.locked():
+            self._rebuild_in_background()
+
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        entries = self._entries
+        results = []
+        seen = set()
+        index = bisect.bisect_left(entries, (prefix,))
+        while index < len(entries) and len(results) < limit:
+            key, text, kind, ref_id = entries[index]
+            if not key.startswith(prefix):
+                break
+            if key not in seen:
+                seen.add(key)
+                results.append({"text": text, "type": kind, "id": ref_id})
+            index += 1
+        return results
+
+
+suggest_index = SuggestIndex()
+
+
+@on_house_change
+def _suggest_changed_house(house_info, created):
+    suggest_index.update_house(house_info["house_id"], house_info["title"], house_info["address"])
@@ -2,16 +2,149 @@
 # -*- coding:utf-8 -*-
 # 项目启动文件
 
+import io
+import sys
+
 from ihome import create_app, db
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
-from ihome import models
+from sqlalchemy import bindparam
+from config import conf
+from ihome import models, counters, ranking, search_index, house_snapshot, facets, keyword_index, similar, \
+    popularity, house_stats, export, house_import, captcha_pool
 
-app = create_app("development")
+# 只有runserver启动后台线程， 其他命令执行完就退出， 不需要定时任务
+app = create_app("development", background=sys.argv[1:2] == ["runserver"])
 
 migrate = Migrate(app, db)
 manager = Manager(app)
 manager.add_command("db", MigrateCommand)
 
+
+@manager.command
+def flush_order_counts():
+    """把redis中累加的房屋订单数写回mysql"""
+    print("flushed %s houses" % counters.flush_order_counts())
+
+
+@manager.command
+def reconcile_order_counts():
+    """根据已完成的订单重新计算房屋订单数"""
+    print("reconciled %s houses" % counters.reconcile_order_counts())
+
+
+@manager.command
+def rebuild_index_rank():
+    """从mysql重新构建首页房屋排行"""
+    print("ranked %s houses" % ranking.rebuild_rank())
+
+
+@manager.command
+def rebuild_search_index():
+    """从mysql重新构建房屋列表的redis索引"""
+    count = search_index.rebuild_index()
+    print("rebuilding by another process" if count is None else "indexed %s houses" % count)
+
+
+@manager.command
+def build_house_snapshot():
+    """从mysql生成房屋列快照"""
+    print("snapshot %s houses" % house_snapshot.build_snapshot())
+
+
+@manager.command
+def backfill_facility_masks():
+    """根据房屋设施表重新计算房屋的设施位掩码"""
+    masks = {}
+    rows = db.session.query(models.house_facility.c.house_id, models.house_facility.c.facility_id)
+    for house_id, facility_id in rows:
+        if not 0 < facility_id <= conf.HOUSE_FACILITY_MAX_ID:
+            print("skip house %s facility %s" % (house_id, facility_id))
+            continue
+        masks[house_id] = masks.get(house_id, 0) | models.House.make_facility_mask([facility_id])
+
+    # 批量UPDATE， 每批一次executemany
+    houses = models.House.__table__
+    stmt = houses.update().where(houses.c.id == bindparam("hid")).values(facility_mask=bindparam("mask"))
+    params = [{"hid": house_id, "mask": mask} for house_id, mask in masks.items()]
+    models.House.query.update({"facility_mask": 0}, synchronize_session=False)
+    for i in range(0, len(params), conf.HOUSE_FACILITY_BACKFILL_BATCH):
+        db.session.execute(stmt, params[i:i + conf.HOUSE_FACILITY_BACKFILL_BATCH])
+    db.session.commit()
+    print("updated %s houses" % len(masks))
+
+
+@manager.command
+def rebuild_facets():
+    """从mysql重新计算房屋搜索的聚合数据"""
+    print("counted %s houses" % facets.rebuild_facets())
+
+
+@manager.command
+def rebuild_keyword_index():
+    """从mysql重新构建房屋关键字索引"""
+    print("indexed %s houses" % keyword_index.rebuild_index())
+
+
+@manager.command
+def build_similar_houses():
+    """计算所有房屋的相似房屋"""
+    print("computed %s houses" % similar.build_similar())
+
+
+@manager.command
+def compute_popularity():
+    """计算所有房屋的衰减热度， 并同步到房屋列表索引"""
+    scores = popularity.compute_popularity()
+    search_index.set_popularity(scores)
+    print("scored %s houses" % len(scores))
+
+
+@manager.command
+def backfill_house_stats():
+    """根据历史订单重新生成房东统计的每日汇总表"""
+    print("processed %s orders" % house_stats.backfill())
+
+
+@manager.option("-t", "--table", dest="table", help="houses or orders", required=True)
+@manager.option("-f", "--format", dest="fmt", default="ndjson", help="ndjson or csv")
+@manager.option("-o", "--output", dest="output", help="output file, append when resuming", required=True)
+@manager.option("-s", "--start-id", dest="start_id", type=int, default=None)
+@manager.option("-e", "--end-id", dest="end_id", type=int, default=None)
+def export_table(table, fmt, output, start_id, end_id):
+    """流式导出房屋或订单表， 中断后用上次输出的last id+1作为--start-id续传"""
+    if table not in export.EXPORT_TABLES or fmt not in export.EXPORT_FORMATS:
+        print("unknown table or format")
+        return
+
+    # 续传时追加到文件末尾， csv不再重复写入列名
+    with io.open(output, "a" if start_id else "w", encoding="utf-8", newline="") as f:
+        count, last_id = export.export_to_file(table, fmt, f, start_id, end_id, header=not start_id)
+    print("exported %s rows, last id %s" % (count, last_id))
+
+
+@manager.option("-u", "--user-id", dest="user_id", type=int, help="owner of the imported houses", required=True)
+@manager.option("-i", "--input", dest="input", help="csv or ndjson file", required=True)
+@manager.option("-f", "--format", dest="fmt", default=None, help="csv or ndjson, default by file extension")
+def import_houses(user_id, input, fmt):
+    """批量导入房屋， 输出失败行的行号和原因"""
+    fmt = fmt or ("csv" if input.endswith(".csv") else "ndjson")
+    if fmt not in house_import.IMPORT_FORMATS:
+        print("unknown format")
+        return
+
+    with io.open(input, encoding="utf-8", newline="" if fmt == "csv" else None) as f:
+        result = house_import.import_houses(user_id, house_import.parse_rows(f, fmt))
+    for error in result["errors"]:
+        print("line %s: %s" % (error["line"], error["errmsg"]))
+    print("imported %s houses, %s failed" % (result["imported"], result["failed"]))
+
+
+@manager.command
+def run_captcha_pool():
+    """持续补充预生成的图片验证码池"""
+    captcha_pool.run_forever()
+
+
 if __name__ == '__main__':
     manager.run()
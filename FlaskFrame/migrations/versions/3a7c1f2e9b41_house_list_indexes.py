@@ -0,0 +1,36 @@
+"""房屋列表按区域过滤、排序使用的组合索引
+
+Revision ID: 3a7c1f2e9b41
+Revises: 5b2e8c1d9f30
+Create Date: 2026-10-19 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a7c1f2e9b41'
+down_revision = '5b2e8c1d9f30'
+branch_labels = None
+depends_on = None
+
+
+# 房屋列表按区域过滤、按单价/成交订单数/发布时间排序使用的组合索引
+HOUSE_INDEXES = (
+    ('ix_house_area_price', ['area_id', 'price']),
+    ('ix_house_area_order_count', ['area_id', 'order_count']),
+    ('ix_house_area_create_time', ['area_id', 'create_time']),
+)
+
+
+def upgrade():
+    for name, columns in HOUSE_INDEXES:
+        op.create_index(name, 'ih_house_info', columns, unique=False)
+
+
+def downgrade():
+    # mysql的外键需要以area_id开头的索引， 创建组合索引时会删除自动生成的外键索引， 删除组合索引之前先补回
+    op.create_index('ix_house_area_id', 'ih_house_info', ['area_id'], unique=False)
+    for name, columns in reversed(HOUSE_INDEXES):
+        op.drop_index(name, table_name='ih_house_info')
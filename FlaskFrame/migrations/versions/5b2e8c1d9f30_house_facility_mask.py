@@ -0,0 +1,27 @@
+"""房屋设施的位掩码
+
+升级之后执行 python manage.py backfill_facility_masks 根据ih_house_facility补齐已有房屋的掩码
+
+Revision ID: 5b2e8c1d9f30
+Revises: 1f0c2b7d4a10
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8c1d9f30'
+down_revision = '1f0c2b7d4a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('ih_house_info', sa.Column('facility_mask', sa.BigInteger(), nullable=True,
+                                             server_default=sa.text('0')))
+
+
+def downgrade():
+    op.drop_column('ih_house_info', 'facility_mask')
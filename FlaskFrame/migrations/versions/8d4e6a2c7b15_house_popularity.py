@@ -0,0 +1,30 @@
+"""房屋热度以及按区域、热度排序的组合索引
+
+升级之后执行 python manage.py compute_popularity 计算已有房屋的热度， 计算之前热度都为0， 按成交订单数排序
+
+Revision ID: 8d4e6a2c7b15
+Revises: 3a7c1f2e9b41
+Create Date: 2026-10-19 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e6a2c7b15'
+down_revision = '3a7c1f2e9b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('ih_house_info', sa.Column('popularity', sa.Float(), nullable=True,
+                                             server_default=sa.text('0')))
+    op.create_index('ix_house_area_popularity', 'ih_house_info', ['area_id', 'popularity', 'order_count'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_house_area_popularity', table_name='ih_house_info')
+    op.drop_column('ih_house_info', 'popularity')
@@ -0,0 +1,35 @@
+"""房屋每日入住与收入的汇总表
+
+升级之后执行 python manage.py backfill_house_stats 根据历史订单生成汇总
+
+Revision ID: c2f91e7a3d58
+Revises: 8d4e6a2c7b15
+Create Date: 2026-10-19 09:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f91e7a3d58'
+down_revision = '8d4e6a2c7b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ih_house_daily_stat',
+                    sa.Column('create_time', sa.DateTime(), nullable=True),
+                    sa.Column('update_time', sa.DateTime(), nullable=True),
+                    sa.Column('house_id', sa.Integer(), nullable=False),
+                    sa.Column('stat_date', sa.Date(), nullable=False),
+                    sa.Column('occupied', sa.Integer(), nullable=False),
+                    sa.Column('revenue', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['house_id'], ['ih_house_info.id'], ),
+                    sa.PrimaryKeyConstraint('house_id', 'stat_date')
+                    )
+
+
+def downgrade():
+    op.drop_table('ih_house_daily_stat')
@@ -0,0 +1,13 @@
+# -*- coding:utf-8 -*-
+# 测试公共配置： 代码以FlaskFrame.xxx导入， 把仓库根目录加入模块搜索路径
+# FlaskFrame.frame按manage.py的方式导入config、utils， 并把日志写到相对路径logs/， 需要FlaskFrame目录
+
+import os
+import sys
+
+FRAME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(FRAME_DIR)
+for path in (ROOT_DIR, FRAME_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.chdir(FRAME_DIR)
@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+"""
+预生成验证码池的测试
+需要可以连接的redis(Config.REDIS_HOST/REDIS_PORT)， 连接不上时跳过； 使用单独的池和锁的键， 不影响正在使用的池
+"""
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("redis")
+pytest.importorskip("PIL")
+
+from flask import Flask
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import captcha_pool, redis_store
+from FlaskFrame.frame.api_1_0 import user as user_views
+
+
+POOL_KEY = "test_captcha_pool"
+LOCK_KEY = "test_captcha_pool_lock"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    try:
+        redis_store.ping()
+    except Exception:
+        pytest.skip("redis is not available")
+
+    monkeypatch.setattr(captcha_pool, "CAPTCHA_POOL_KEY", POOL_KEY)
+    monkeypatch.setattr(captcha_pool, "CAPTCHA_POOL_LOCK", LOCK_KEY)
+    redis_store.delete(POOL_KEY, LOCK_KEY, "ImageCode_test-1")
+    yield POOL_KEY
+    redis_store.delete(POOL_KEY, LOCK_KEY, "ImageCode_test-1")
+
+
+class _FakeWorkers(object):
+    """用固定的验证码代替工作进程， before_each在生成每个验证码之前调用"""
+
+    def __init__(self, before_each=None):
+        self.before_each = before_each
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        for i in iterable:
+            if self.before_each:
+                self.before_each()
+            yield ("T%03d" % i).encode("utf-8") + b"|jpeg-%d" % i
+
+
+def test_image_code_pops_from_filled_pool(pool):
+    redis_store.rpush(pool, b"ABCD|jpeg-data", b"EFGH|jpeg-other")
+
+    app = Flask(__name__)
+    with app.test_request_context("/api/v1.0/imagecode/test-1"):
+        response = user_views.generate_image_code("test-1")
+
+    assert response.get_data() == b"jpeg-data"
+    assert redis_store.get("ImageCode_test-1") == b"ABCD"
+    assert 0 < redis_store.ttl("ImageCode_test-1") <= conf.IMAGE_CODE_REDIS_EXPIRES
+    assert redis_store.llen(pool) == 1
+
+
+def test_refill_fills_pool_and_releases_lock(pool, monkeypatch):
+    monkeypatch.setattr(conf, "CAPTCHA_POOL_SIZE", 10)
+    monkeypatch.setattr(conf, "CAPTCHA_POOL_LOW_WATERMARK", 5)
+    monkeypatch.setattr(conf, "CAPTCHA_POOL_BATCH", 4)
+    monkeypatch.setattr(captcha_pool, "_worker_pool", lambda: _FakeWorkers())
+
+    assert captcha_pool.refill_once() == 10
+    assert redis_store.llen(pool) == 10
+    assert not redis_store.exists(LOCK_KEY)
+
+
+def test_refill_keeps_lock_taken_over_by_another_worker(pool, monkeypatch):
+    monkeypatch.setattr(conf, "CAPTCHA_POOL_SIZE", 3)
+    monkeypatch.setattr(conf, "CAPTCHA_POOL_LOW_WATERMARK", 1)
+
+    def lock_expired_and_taken():
+        # 模拟补充期间锁过期， 被另一个进程获取
+        redis_store.set(LOCK_KEY, "other-worker")
+
+    monkeypatch.setattr(captcha_pool, "_worker_pool", lambda: _FakeWorkers(lock_expired_and_taken))
+
+    assert captcha_pool.refill_once() == 3
+    assert redis_store.get(LOCK_KEY) == b"other-worker"
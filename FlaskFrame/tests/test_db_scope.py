@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+"""
+db_scope.outbound的测试
+调用外部接口期间不能持有数据库连接， 会话中有没有提交的修改时outbound报错
+"""
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("redis")
+
+from flask import Flask
+from sqlalchemy import event
+
+from FlaskFrame.frame import db, db_scope
+from FlaskFrame.frame.models import Area
+
+
+@pytest.fixture
+def app(tmpdir):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % tmpdir.join("test.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all(tables=[Area.__table__])
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def checked_out(app):
+    """当前借出的数据库连接数"""
+
+    counter = {"count": 0}
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counter["count"] += 1
+
+    def on_checkin(dbapi_connection, connection_record):
+        counter["count"] -= 1
+
+    engine = db.get_engine(app)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+    yield counter
+    event.remove(engine, "checkout", on_checkout)
+    event.remove(engine, "checkin", on_checkin)
+
+
+def test_outbound_releases_connection_during_external_call(app, checked_out):
+    seen = []
+
+    def external_call():
+        # 模拟的七牛云/短信接口， 记录调用时借出的连接数
+        seen.append(checked_out["count"])
+        return "ok"
+
+    with app.test_request_context("/"):
+        Area.query.all()
+        assert checked_out["count"] == 1
+
+        with db_scope.outbound("mock"):
+            assert external_call() == "ok"
+
+    assert seen == [0]
+
+
+def test_outbound_rejects_pending_changes(app):
+    with app.test_request_context("/"):
+        db.session.add(Area(name="test"))
+        with pytest.raises(RuntimeError):
+            with db_scope.outbound("mock"):
+                pass
+
+
+def test_outbound_rejects_flushed_changes(app):
+    with app.test_request_context("/"):
+        db.session.add(Area(name="test"))
+        db.session.flush()
+        with pytest.raises(RuntimeError):
+            with db_scope.outbound("mock"):
+                pass
+
+        db.session.commit()
+        with db_scope.outbound("mock"):
+            pass
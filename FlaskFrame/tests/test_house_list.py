@@ -0,0 +1,105 @@
+# -*- coding:utf-8 -*-
+"""
+房屋列表get_houses_list的测试
+使用sqlite的临时数据库和临时的关键字索引文件， 分别走普通的排序分页和关键字查询两条路径
+"""
+
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("redis")
+
+from flask import Flask
+
+from FlaskFrame.config import conf
+from FlaskFrame.frame import db, keyword_index, redis_scripts
+from FlaskFrame.frame.api_1_0 import house as house_views
+from FlaskFrame.frame.models import Area, House, User
+
+
+class _NoCache(object):
+    """列表缓存总是未命中"""
+
+    def hget(self, name, key):
+        return None
+
+
+@pytest.fixture
+def app(tmpdir, monkeypatch):
+    monkeypatch.setattr(conf, "HOUSE_SEARCH_BACKEND", "mysql")
+    monkeypatch.setattr(conf, "HOUSE_KEYWORD_INDEX_PATH", str(tmpdir.join("index", "house_keyword.db")))
+    monkeypatch.setattr(keyword_index, "_local", threading.local())
+    monkeypatch.setattr(house_views, "redis_store", _NoCache())
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % tmpdir.join("test.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all(tables=[User.__table__, Area.__table__, House.__table__])
+        _fill()
+        keyword_index.rebuild_index()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    """写入列表缓存的参数"""
+
+    calls = []
+    monkeypatch.setattr(redis_scripts, "hset_expire", lambda *args: calls.append(args))
+    return calls
+
+
+def _fill():
+    db.session.execute(User.__table__.insert(), [{"id": 1, "name": "owner", "password_hash": "x",
+                                                  "mobile": "13800000000"}])
+    db.session.execute(Area.__table__.insert(), [{"id": 1, "name": u"朝阳区"}, {"id": 2, "name": u"海淀区"}])
+    houses = [
+        (1, 1, u"朝阳公寓", 30000),
+        (2, 1, u"海淀小院", 10000),
+        (3, 1, u"朝阳大床房", 20000),
+        (4, 2, u"朝阳别墅", 50000),
+    ]
+    db.session.execute(House.__table__.insert(), [{
+        "id": house_id, "user_id": 1, "area_id": area_id, "title": title, "address": "", "price": price,
+        "capacity": 2, "order_count": 0, "popularity": 0, "facility_mask": 0, "index_image_url": "",
+    } for house_id, area_id, title, price in houses])
+    db.session.commit()
+
+
+def _get_list(app, query_string):
+    with app.test_request_context("/api/v1.0/houses?" + query_string):
+        result = house_views.get_houses_list()
+    return json.loads(result if isinstance(result, str) else result.get_data(as_text=True))
+
+
+def test_list_without_keyword(app, cached):
+    resp = _get_list(app, "aid=1&sk=price-inc&p=1")
+
+    assert resp["errno"] == 0
+    assert [house["house_id"] for house in resp["data"]["houses"]] == [2, 3]
+    assert resp["data"]["total_page"] == 2
+    # 第1页写入列表缓存， 使用列表的有效期
+    assert [(args[1], args[3]) for args in cached] == [(1, conf.HOUSE_LIST_REDIS_EXPIRES)]
+
+
+def test_list_with_keyword(app, cached):
+    resp = _get_list(app, "aid=1&sk=price-des&q=%E6%9C%9D%E9%98%B3&p=1")
+
+    assert resp["errno"] == 0
+    assert [house["house_id"] for house in resp["data"]["houses"]] == [1, 3]
+    assert resp["data"]["total_page"] == 1
+
+
+def test_list_with_keyword_second_page(app, cached):
+    resp = _get_list(app, "sk=price-inc&q=%E6%9C%9D%E9%98%B3&p=2")
+
+    assert resp["errno"] == 0
+    assert [house["house_id"] for house in resp["data"]["houses"]] == [4]
+    assert resp["data"]["total_page"] == 2
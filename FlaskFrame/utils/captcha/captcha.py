@@ -6,6 +6,8 @@
 import random
 import string
 import os.path
+import sys
+import time
 from cStringIO import StringIO
 
 from PIL import Image
@@ -59,6 +61,10 @@ class Captcha(object):
         self._bezier = Bezier()
         self._dir = os.path.dirname(__file__)
         # self._captcha_path = os.path.join(self._dir, '..', 'static', 'captcha')
+        # per-process cache of truetype fonts and glyph masks, so fonts are parsed once
+        self.use_cache = True
+        self._fonts = {}
+        self._glyphs = {}
 
     @staticmethod
     def instance():
@@ -120,20 +126,37 @@ class Captcha(object):
             draw.line(((x, y), (x + level, y)), fill=color if color else self._color, width=level)
         return image
 
+    @staticmethod
+    def glyph(fonts, glyphs, key, c):
+        """ Returns the cropped grayscale mask of a character
+            fonts: {(name, size): truetype font}, glyphs: {(name, size, c): mask}, filled on miss
+        """
+        mask = glyphs.get(key + (c,))
+        if mask is None:
+            font = fonts.get(key)
+            if font is None:
+                font = fonts[key] = truetype(*key)
+            mask = Image.new('L', font.getsize(c), 0)
+            Draw(mask).text((0, 0), c, font=font, fill=255)
+            mask = glyphs[key + (c,)] = mask.crop(mask.getbbox())
+        return mask
+
     def text(self, image, fonts, font_sizes=None, drawings=None, squeeze_factor=0.75, color=None):
         color = color if color else self._color
-        fonts = tuple([truetype(name, size)
-                       for name in fonts
-                       for size in font_sizes or (65, 70, 75)])
-        draw = Draw(image)
+        font_keys = tuple([(name, size)
+                           for name in fonts
+                           for size in font_sizes or (65, 70, 75)])
+        if self.use_cache:
+            loaded, glyphs = self._fonts, self._glyphs
+        else:
+            # without the cache every font/size is loaded for each captcha, as before
+            loaded, glyphs = dict((key, truetype(*key)) for key in font_keys), {}
         char_images = []
         for c in self._text:
-            font = random.choice(fonts)
-            c_width, c_height = draw.textsize(c, font=font)
-            char_image = Image.new('RGB', (c_width, c_height), (0, 0, 0))
-            char_draw = Draw(char_image)
-            char_draw.text((0, 0), c, font=font, fill=color)
-            char_image = char_image.crop(char_image.getbbox())
+            # colorizing the mask equals drawing the character in color on black
+            mask = self.glyph(loaded, glyphs, random.choice(font_keys), c)
+            char_image = Image.new('RGB', mask.size, (0, 0, 0))
+            char_image.paste(color[:3], (0, 0) + mask.size, mask)
             for drawing in drawings:
                 d = getattr(self, drawing)
                 char_image = d(char_image)
@@ -219,5 +242,26 @@ class Captcha(object):
 
 captcha = Captcha.instance()
 
+
+def benchmark(number=200, repeat=3):
+    """ Prints captchas per second without and with the font/glyph cache,
+        best of `repeat` runs, so the glyph cache is warm after the first run
+    """
+    for use_cache in (False, True):
+        engine = Captcha()
+        engine.use_cache = use_cache
+        engine.generate_captcha()
+        best = 0
+        for _ in xrange(repeat):
+            start = time.time()
+            for _ in xrange(number):
+                engine.generate_captcha()
+            best = max(best, number / (time.time() - start))
+        print("cache=%s: best of %d x %d captchas, %.1f captchas/s" % (use_cache, repeat, number, best))
+
+
 if __name__ == '__main__':
-    print(captcha.generate_captcha())
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    else:
+        print(captcha.generate_captcha())